@@ -0,0 +1,172 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import logging
+import multiprocessing
+import time
+from concurrent.futures import (FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+
+import news_generator
+from util import setup_logging
+from util_edition import GENERATOR_STAGES, Edition, EditionStage
+
+# Stages waiting on openai, edge-tts or news sites, which run in threads
+_NETWORK_STAGES = {
+    EditionStage.FETCH_NEWS,
+    EditionStage.SUMMARIZE_NEWS,
+    EditionStage.READ_NEWS,
+    EditionStage.READ_COVER_AND_ENDING,
+}
+# The others render slides and encode videos, which run in processes to use all cores
+_STAGE_DEPENDENCIES = {
+    EditionStage.FETCH_NEWS: [],
+    EditionStage.SUMMARIZE_NEWS: [EditionStage.FETCH_NEWS],
+    EditionStage.READ_NEWS: [EditionStage.SUMMARIZE_NEWS],
+    EditionStage.READ_COVER_AND_ENDING: [],
+    EditionStage.RECORD_NEWS: [EditionStage.READ_NEWS, EditionStage.READ_COVER_AND_ENDING],
+}
+
+
+def _run_generator_stage(args: List[str]):
+    news_generator.main.main(args=args, standalone_mode=False)
+
+
+def _get_editions(data_dir_path: Path, from_date: Optional[str], to_date: Optional[str],
+                  edition_dirs: List[str]) -> List[Edition]:
+    editions = []
+    if from_date:
+        date = datetime.strptime(from_date, '%Y%m%d')
+        end_date = datetime.strptime(to_date or from_date, '%Y%m%d')
+        while date <= end_date:
+            editions.append(
+                Edition(date=date.strftime('%Y%m%d'),
+                        data_dir_path=data_dir_path / date.strftime('%Y%m%d')))
+            date += timedelta(days=1)
+    for edition_dir in edition_dirs:
+        edition_dir_path = Path(edition_dir)
+        # Either data/{YYYYMMDD} or an intra-day edition data/{YYYYMMDD}_{HHMM}
+        editions.append(
+            Edition(
+                date=edition_dir_path.name[:8],
+                data_dir_path=edition_dir_path,
+                edition_time=edition_dir_path.name[9:]))
+    return editions
+
+
+def _plan_stages(edition: Edition, rerun_stages: Set[EditionStage]) -> List[EditionStage]:
+    """Returns the stages to run, i.e. those rerun, without artifacts or after a planned one."""
+    planned_stages: List[EditionStage] = []
+    for stage in GENERATOR_STAGES:
+        if (stage in rerun_stages or not edition.has_stage_artifacts(stage) or
+                any(dependency in planned_stages for dependency in _STAGE_DEPENDENCIES[stage])):
+            planned_stages.append(stage)
+    if (EditionStage.FETCH_NEWS in planned_stages and
+            edition.date != datetime.now().strftime('%Y%m%d')):
+        # The sources only serve the current hot news, which must not go into a past edition
+        logging.warning('Skip {}, as news cannot be fetched for the past date {}'.format(
+            str(edition.data_dir_path), edition.date))
+        return []
+    return planned_stages
+
+
+def _submit_ready_stages(editions: List[Edition], pending_stages: Dict[int, List[EditionStage]],
+                         running_futures: Dict[Future, Tuple[int, EditionStage, float]],
+                         network_executor: Executor, cpu_executor: Executor):
+    """Submits the pending stages whose dependencies are done, moving them to running_futures."""
+    running_stages = {(index, stage) for index, stage, _ in running_futures.values()}
+    for index, stages in pending_stages.items():
+        for stage in list(stages):
+            blocked = any(dependency in stages or (index, dependency) in running_stages
+                          for dependency in _STAGE_DEPENDENCIES[stage])
+            if blocked:
+                continue
+            executor = network_executor if stage in _NETWORK_STAGES else cpu_executor
+            future = executor.submit(_run_generator_stage, editions[index].get_stage_args(stage))
+            running_futures[future] = (index, stage, time.time())
+            running_stages.add((index, stage))
+            stages.remove(stage)
+
+
+@click.group()
+def main():
+    setup_logging()
+
+
+@main.command()
+@click.option('--data_dir', default='data', type=click.Path(file_okay=False))
+@click.option('--from_date', type=str, help='YYYYMMDD of the first edition of the range')
+@click.option(
+    '--to_date', type=str, help='YYYYMMDD of the last edition, the same as from_date by default')
+@click.option(
+    '--edition_dir',
+    'edition_dirs',
+    multiple=True,
+    type=click.Path(file_okay=False, exists=True),
+    help='An existing edition dir to backfill, can be repeated')
+@click.option(
+    '--rerun',
+    'rerun_stage_values',
+    multiple=True,
+    type=click.Choice([stage.value for stage in GENERATOR_STAGES]),
+    help='Run the stage and the stages after it even if their artifacts exist, can be repeated')
+@click.option('--network_concurrency', default=4, type=int, help='Max network stages at once')
+@click.option('--cpu_concurrency', default=2, type=int, help='Max record stages at once')
+def run(data_dir: str, from_date: Optional[str], to_date: Optional[str], edition_dirs: List[str],
+        rerun_stage_values: List[str], network_concurrency: int, cpu_concurrency: int):
+    """Generates many editions at once, sharing the workers between their stages."""
+    editions = _get_editions(Path(data_dir), from_date, to_date, edition_dirs)
+    if not editions:
+        raise click.UsageError('Specify --from_date or --edition_dir')
+    rerun_stages = {EditionStage(value) for value in rerun_stage_values}
+    pending_stages: Dict[int, List[EditionStage]] = {}
+    for index, edition in enumerate(editions):
+        edition.data_dir_path.mkdir(parents=True, exist_ok=True)
+        pending_stages[index] = _plan_stages(edition, rerun_stages)
+        logging.info('Planned stages for {}: {}'.format(
+            str(edition.data_dir_path),
+            ', '.join([stage.value for stage in pending_stages[index]]) or 'none'))
+
+    network_executor = ThreadPoolExecutor(max_workers=network_concurrency)
+    # Spawn rather than fork, as the network stages are already running in threads
+    cpu_executor = ProcessPoolExecutor(
+        max_workers=cpu_concurrency, mp_context=multiprocessing.get_context('spawn'))
+    running_futures: Dict[Future, Tuple[int, EditionStage, float]] = {}
+    failed_editions: List[str] = []
+    start_time = time.time()
+    try:
+        while True:
+            _submit_ready_stages(editions, pending_stages, running_futures, network_executor,
+                                 cpu_executor)
+            if not running_futures:
+                break
+            done_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                index, stage, stage_start_time = running_futures.pop(future)
+                edition_dir = str(editions[index].data_dir_path)
+                if future.exception() is not None:
+                    logging.error('Failed to run {} for {}, skip the rest of it: {}'.format(
+                        stage.value, edition_dir, future.exception()))
+                    pending_stages[index] = []
+                    if edition_dir not in failed_editions:
+                        failed_editions.append(edition_dir)
+                else:
+                    logging.info('Finished {} for {} in {:.1f} secs'.format(
+                        stage.value, edition_dir,
+                        time.time() - stage_start_time))
+    finally:
+        network_executor.shutdown()
+        cpu_executor.shutdown()
+    logging.info('Backfilled {} editions in {:.1f} secs'.format(
+        len(editions),
+        time.time() - start_time))
+    if failed_editions:
+        raise click.ClickException('Failed editions: {}'.format(', '.join(failed_editions)))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,7 @@ class News():
     image_path: str = ''
     brief_content: str = ''
     audio_path: str = ''
+    audio_duration: float = 0.0
 
     def as_dict(self) -> dict:
         return asdict(self)
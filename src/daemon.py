@@ -0,0 +1,172 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+
+# Import the commands once, so that heavy libraries, fonts, http connections and the tts voice
+# list stay warm between editions
+import news_generator
+import video_uploader
+from util import setup_logging
+from util_edition import GENERATOR_STAGES, Edition, EditionStage
+
+_STATUS_HOST = '127.0.0.1'
+_MAX_SLEEP_SECS = 30
+
+
+class _DaemonStatus():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = datetime.now()
+        self.next_run_time: Optional[datetime] = None
+        self.current_edition = ''
+        self.current_stage = ''
+        self.last_success_edition = ''
+        self.last_success_time: Optional[datetime] = None
+        self.last_error = ''
+        self.last_error_time: Optional[datetime] = None
+
+    def update(self, **kwargs):
+        with self.lock:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in vars(self).items()
+                if key != 'lock'
+            }
+
+
+class _StatusRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path not in ('/', '/health', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.daemon_status.as_dict(), ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug('Status request: ' + format, *args)
+
+
+def _start_status_server(daemon_status: _DaemonStatus, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((_STATUS_HOST, port), _StatusRequestHandler)
+    server.daemon_status = daemon_status
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info('Serving daemon status on http://{}:{}/health'.format(_STATUS_HOST, port))
+    return server
+
+
+def _parse_schedule_time(schedule_time: str) -> Tuple[int, int]:
+    hour, minute = schedule_time.split(':')
+    return int(hour), int(minute)
+
+
+def _get_next_run(now: datetime, daily_at: str, extra_ats: List[str]) -> Tuple[datetime, bool]:
+    """Returns the next run time and whether it is the daily edition."""
+    candidates = []
+    schedule = [(daily_at, True)] + [(extra_at, False) for extra_at in extra_ats]
+    for schedule_time, is_daily in schedule:
+        hour, minute = _parse_schedule_time(schedule_time)
+        run_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run_time <= now:
+            run_time += timedelta(days=1)
+        candidates.append((run_time, is_daily))
+    return min(candidates, key=lambda candidate: candidate[0])
+
+
+def _get_edition(data_dir_path: Path, run_time: datetime, is_daily: bool) -> Edition:
+    date = run_time.strftime('%Y%m%d')
+    if is_daily:
+        return Edition(date=date, data_dir_path=data_dir_path / date)
+    # Intra-day editions get their own data dirs, next to the daily one, and their own titles
+    edition_time = run_time.strftime('%H%M')
+    return Edition(
+        date=date,
+        data_dir_path=data_dir_path / '{}_{}'.format(date, edition_time),
+        edition_time=edition_time)
+
+
+def _run_edition(edition: Edition, upload: bool, daemon_status: _DaemonStatus):
+    edition.data_dir_path.mkdir(parents=True, exist_ok=True)
+    stages = GENERATOR_STAGES + ([EditionStage.UPLOAD_TO_BILIBILI] if upload else [])
+    start_time = time.time()
+    daemon_status.update(current_edition=str(edition.data_dir_path))
+    try:
+        for stage in stages:
+            logging.info('Running {} for {}'.format(stage.value, str(edition.data_dir_path)))
+            daemon_status.update(current_stage=stage.value)
+            command_group = (video_uploader.main
+                             if stage == EditionStage.UPLOAD_TO_BILIBILI else news_generator.main)
+            command_group.main(args=edition.get_stage_args(stage), standalone_mode=False)
+    except Exception as exception:  # pylint: disable=broad-except
+        logging.exception('Failed to run {} for {}: {}'.format(daemon_status.current_stage,
+                                                               str(edition.data_dir_path),
+                                                               exception))
+        daemon_status.update(
+            last_error='{}: {}'.format(daemon_status.current_stage, exception),
+            last_error_time=datetime.now())
+    else:
+        logging.info('Finished {} in {:.1f} secs'.format(
+            str(edition.data_dir_path),
+            time.time() - start_time))
+        daemon_status.update(
+            last_success_edition=str(edition.data_dir_path), last_success_time=datetime.now())
+    finally:
+        daemon_status.update(current_edition='', current_stage='')
+
+
+@click.group()
+def main():
+    setup_logging()
+
+
+@main.command()
+@click.option('--data_dir', default='data', type=click.Path(file_okay=False))
+@click.option('--daily_at', default='06:00', type=str, help='HH:MM of the daily edition')
+@click.option(
+    '--extra_at',
+    'extra_ats',
+    multiple=True,
+    type=str,
+    help='HH:MM of an extra intra-day edition, can be repeated')
+@click.option('--upload/--no_upload', default=False)
+@click.option('--status_port', default=8765, type=int)
+@click.option('--run_now', is_flag=True, help='Run a daily edition right after starting')
+def run(data_dir: str, daily_at: str, extra_ats: List[str], upload: bool, status_port: int,
+        run_now: bool):
+    data_dir_path = Path(data_dir)
+    daemon_status = _DaemonStatus()
+    _start_status_server(daemon_status, status_port)
+    if run_now:
+        _run_edition(_get_edition(data_dir_path, datetime.now(), True), upload, daemon_status)
+    while True:
+        next_run_time, is_daily = _get_next_run(datetime.now(), daily_at, extra_ats)
+        daemon_status.update(next_run_time=next_run_time)
+        logging.info('Next edition at {}'.format(next_run_time.isoformat()))
+        # Sleep in short steps to follow wall clock adjustments
+        while datetime.now() < next_run_time:
+            time.sleep(
+                max(0, min(_MAX_SLEEP_SECS, (next_run_time - datetime.now()).total_seconds())))
+        _run_edition(_get_edition(data_dir_path, next_run_time, is_daily), upload, daemon_status)
+
+
+if __name__ == '__main__':
+    main()
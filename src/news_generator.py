@@ -4,15 +4,26 @@ import json
 from datetime import datetime
 from pathlib import Path
 from enum import Enum
+from typing import List, Optional
 
 import click
 
-from util import setup_logging, sync
+from class_news import News
+from util import iterate_in_thread, setup_logging, sync
+from util_duration import DurationBudget, SpeechRateCalibration
 from util_news import read_news_json, write_news_json
-from util_summarize import init_openai, summarize_news_with_gpt
-from util_tencent_news import get_tencent_hot_ranking_list
-from util_tts import read_text_with_edge_tts, read_news_with_edge_tts, validate_edge_tts_voices
-from util_video import generate_news_video, generate_news_video_description
+from util_news_store import NewsStatus, NewsStore
+from util_profile import ProfiledGroup
+from util_summarize import (init_openai, log_openai_usage, stream_news_summary_with_gpt,
+                            summarize_news_list_with_gpt)
+from util_news_source import aggregate_news, fetch_news_images
+from util_request import request_deadline
+from util_tencent_news import TencentNewsSource
+from util_tts import (read_news_summary_stream_with_edge_tts, read_news_with_edge_tts,
+                      read_text_with_edge_tts, validate_edge_tts_voices)
+from util_video import (DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES, benchmark_encoder_profiles,
+                        format_layout_report, generate_news_preview, generate_news_video,
+                        generate_news_video_description)
 
 _COVER_TXT = '十分钟带你看完时下热点。大家好，欢迎收听《十分热》每日新闻，今天是{year}年{month}月{day}日，星期{weekday}。'
 _ENDING_TXT = '以上是全部内容，感谢您的收看，再见！'
@@ -26,6 +37,13 @@ _WEEKDAY_TO_CHINESE_CHAR = {
     6: '日',
 }
 
+_DEFAULT_VOICES = 'zh-CN-YunyangNeural,zh-CN-YunjianNeural'
+_DEFAULT_RATE = '+10%'
+_DEFAULT_SPEECH_RATE_FILE = 'data/speech_rate.json'
+# Extra news kept beyond the budget, for the summaries that fail or turn out short
+_FETCH_RESERVE_NUM = 3
+_SUMMARIZE_RESERVE_NUM = 1
+
 _CONFIG = {}
 with open('config.json', 'r') as f:
     _CONFIG = json.loads(f.read())
@@ -35,71 +53,279 @@ class NewsSource(Enum):
     TENCENT = 'tencent'
 
 
-@click.group()
+@click.group(cls=ProfiledGroup)
 def main():
     setup_logging()
 
 
+def _check_news_output(news_json: Optional[str], news_db: Optional[str]):
+    if not news_json and not news_db:
+        raise click.UsageError('Either --news_json or --news_db is required.')
+
+
+def _read_news_list(news_json: Optional[str], news_db: Optional[str], date: str) -> List[News]:
+    if news_db:
+        news_store = NewsStore(Path(news_db))
+        news_list = news_store.read_news_list(date)
+        news_store.close()
+        return news_list
+    if news_json:
+        return read_news_json(Path(news_json))
+    raise click.UsageError('Either --news_json or --news_db is required.')
+
+
+def _write_news_list(news_list: List[News], news_json: Optional[str], news_db: Optional[str],
+                     date: str, status: NewsStatus, input_news_list: Optional[List[News]] = None):
+    """Writes the news of a stage, where the input news missing in the output are dropped."""
+    _check_news_output(news_json, news_db)
+    if news_db:
+        news_store = NewsStore(Path(news_db))
+        if input_news_list is None:
+            news_store.delete_news_list(date)
+        news_store.upsert_news_list(date, news_list, status)
+        if input_news_list is not None:
+            output_urls = {news.url for news in news_list}
+            news_store.mark_dropped(
+                date, [news for news in input_news_list if news.url not in output_urls])
+        news_store.close()
+    if news_json:
+        news_json_path = Path(news_json)
+        news_json_path.parent.mkdir(parents=True, exist_ok=True)
+        write_news_json(news_list, news_json_path)
+
+
+def _get_duration_budget(duration_budget_secs: Optional[float], voices: List[str], rate: str,
+                         speech_rate_file: str) -> Optional[DurationBudget]:
+    if duration_budget_secs is None:
+        return None
+    try:
+        return DurationBudget(
+            total_secs=duration_budget_secs,
+            voices=voices,
+            rate=rate,
+            calibration=SpeechRateCalibration(Path(speech_rate_file)))
+    except ValueError as exception:
+        raise click.BadParameter(str(exception), param_hint='--duration_budget_secs')
+
+
+def _calibrate_speech_rate(news_list: List[News], voices: List[str], rate: str,
+                           speech_rate_file: str):
+    # The news are read with the voices in turn by their kept positions
+    news_voices = [voices[index % len(voices)] for index in range(len(news_list))]
+    if news_list:
+        SpeechRateCalibration(Path(speech_rate_file)).update(news_list, news_voices, rate)
+
+
 @main.command()
-@click.option('--news_json', required=True, type=click.Path(dir_okay=False))
+@click.option('--news_json', type=click.Path(dir_okay=False))
+@click.option('--news_db', type=click.Path(dir_okay=False))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
 @click.option('--image_dir', required=True, type=click.Path(file_okay=False))
 @click.option(
     '--source',
+    'sources',
     type=click.Choice([news_source.value for news_source in NewsSource]),
-    default='tencent')
+    default=['tencent'],
+    multiple=True,
+    help='Repeat to aggregate several sources concurrently')
 @click.option('--news_num', default=20, type=int)
-def fetch_news(news_json: str, image_dir: str, source: str, news_num: int):
-    news_json_path = Path(news_json)
-    news_json_path.parent.mkdir(parents=True, exist_ok=True)
+@click.option(
+    '--source_time_budget_secs',
+    default=180,
+    type=float,
+    help='Sources still fetching after it contribute only the news they already got')
+@click.option(
+    '--dedup_threshold',
+    default=0.5,
+    type=float,
+    help='Estimated jaccard similarity to merge near-duplicate news, above 1 to disable')
+@click.option(
+    '--deadline_secs',
+    type=float,
+    help='Fail all requests of the stage after it, including retries and image downloads')
+@click.option(
+    '--duration_budget_secs',
+    type=float,
+    help='Stop pulling news once their estimated spoken length fills the program')
+@click.option('--voices', 'voices_str', default=_DEFAULT_VOICES, type=str)
+@click.option('--rate', default=_DEFAULT_RATE, type=str)
+@click.option(
+    '--speech_rate_file', default=_DEFAULT_SPEECH_RATE_FILE, type=click.Path(dir_okay=False))
+def fetch_news(news_json: Optional[str], news_db: Optional[str], date: str, image_dir: str,
+               sources: List[str], news_num: int, source_time_budget_secs: float,
+               dedup_threshold: float, deadline_secs: Optional[float],
+               duration_budget_secs: Optional[float], voices_str: str, rate: str,
+               speech_rate_file: str):
+    # Fail before fetching anything rather than after all the sources and images
+    _check_news_output(news_json, news_db)
     image_dir_path = Path(image_dir)
     image_dir_path.mkdir(parents=True, exist_ok=True)
-    if source == NewsSource.TENCENT.value:
-        news_list = get_tencent_hot_ranking_list(news_num=news_num, image_dir_path=image_dir_path)
-    else:
-        raise ValueError('Unknown news source {}'.format(source))
-    write_news_json(news_list, news_json_path)
+    plugins = []
+    for source in dict.fromkeys(sources):
+        if source == NewsSource.TENCENT.value:
+            plugins.append(TencentNewsSource(dedup_threshold=dedup_threshold))
+        else:
+            raise ValueError('Unknown news source {}'.format(source))
+    duration_budget = _get_duration_budget(duration_budget_secs, voices_str.split(','), rate,
+                                           speech_rate_file)
+    with request_deadline(deadline_secs):
+        news_list_without_image = aggregate_news(
+            plugins=plugins,
+            news_num=news_num,
+            time_budget_secs=source_time_budget_secs,
+            dedup_threshold=dedup_threshold,
+            is_enough=(lambda news_list: duration_budget.is_filled(news_list, _FETCH_RESERVE_NUM))
+            if duration_budget else None)
+        news_list = fetch_news_images(news_list_without_image, image_dir_path)
+    _write_news_list(news_list, news_json, news_db, date, NewsStatus.FETCHED)
 
 
 @main.command()
-@click.option('--news_json', required=True, type=click.Path(dir_okay=False, exists=True))
-def summarize_news(news_json: str):
-    news_json_path = Path(news_json)
-    news_list_without_summary = read_news_json(news_json_path)
-    news_list = []
-    init_openai(_CONFIG['openai_api_key'], _CONFIG['openai_proxy'])
-    for news in news_list_without_summary:
-        news_with_summary = summarize_news_with_gpt(news=news)
-        if news_with_summary:
-            news_list.append(news_with_summary)
-    write_news_json(news_list, news_json_path)
+@click.option('--news_json', type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_db', type=click.Path(dir_okay=False, exists=True))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
+@click.option('--batch_size', default=1, type=int, help='Max news summarized per request')
+@click.option(
+    '--duration_budget_secs',
+    type=float,
+    help='Stop requesting openai once the estimated spoken length of summaries fills the program')
+@click.option('--voices', 'voices_str', default=_DEFAULT_VOICES, type=str)
+@click.option('--rate', default=_DEFAULT_RATE, type=str)
+@click.option(
+    '--speech_rate_file', default=_DEFAULT_SPEECH_RATE_FILE, type=click.Path(dir_okay=False))
+def summarize_news(news_json: Optional[str], news_db: Optional[str], date: str, batch_size: int,
+                   duration_budget_secs: Optional[float], voices_str: str, rate: str,
+                   speech_rate_file: str):
+    news_list_without_summary = _read_news_list(news_json, news_db, date)
+    duration_budget = _get_duration_budget(duration_budget_secs, voices_str.split(','), rate,
+                                           speech_rate_file)
+    init_openai(_CONFIG['openai_api_key'], _CONFIG['openai_proxy'], _CONFIG.get('openai_pool'))
+    news_list = summarize_news_list_with_gpt(
+        news_list=news_list_without_summary,
+        batch_size=batch_size,
+        is_enough=(lambda news_list: duration_budget.is_filled(news_list, _SUMMARIZE_RESERVE_NUM))
+        if duration_budget else None)
+    log_openai_usage()
+    _write_news_list(news_list, news_json, news_db, date, NewsStatus.SUMMARIZED,
+                     news_list_without_summary)
 
 
 @main.command()
-@click.option('--news_json', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_json', type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_db', type=click.Path(dir_okay=False, exists=True))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
 @click.option('--audio_dir', required=True, type=click.Path(file_okay=False))
-@click.option('--voices', 'voices_str', default='zh-CN-YunyangNeural,zh-CN-YunjianNeural', type=str)
-@click.option('--rate', default='+10%', type=str)
+@click.option('--voices', 'voices_str', default=_DEFAULT_VOICES, type=str)
+@click.option('--rate', default=_DEFAULT_RATE, type=str)
 @click.option('--volume', default='+100%', type=str)
-def read_news(news_json: str, audio_dir: str, voices_str: str, rate: str, volume: str):
-    news_json_path = Path(news_json)
-    news_list_without_audio = read_news_json(news_json_path)
+@click.option(
+    '--chunked', is_flag=True, help='Synthesize sentences concurrently and join them with gaps')
+@click.option('--sentence_gap_secs', default=0.3, type=float)
+@click.option('--tts_concurrency', default=4, type=int)
+@click.option(
+    '--duration_budget_secs',
+    type=float,
+    help='Stop reading once the measured audios fill the program, then trim to the closest length')
+@click.option(
+    '--speech_rate_file', default=_DEFAULT_SPEECH_RATE_FILE, type=click.Path(dir_okay=False))
+@click.option(
+    '--calibrate_speech_rate',
+    is_flag=True,
+    help='Learn the speech rates from the measured audios into --speech_rate_file')
+def read_news(news_json: Optional[str], news_db: Optional[str], date: str, audio_dir: str,
+              voices_str: str, rate: str, volume: str, chunked: bool, sentence_gap_secs: float,
+              tts_concurrency: int, duration_budget_secs: Optional[float], speech_rate_file: str,
+              calibrate_speech_rate: bool):
+    news_list_without_audio = _read_news_list(news_json, news_db, date)
     audio_dir_path = Path(audio_dir)
     audio_dir_path.mkdir(parents=True, exist_ok=True)
     news_list = []
     voices = voices_str.split(',')
     sync(validate_edge_tts_voices(voices))
-    for index, news in enumerate(news_list_without_audio):
-        audio_path = audio_dir_path / '{}.mp3'.format(str(index).zfill(2))
+    duration_budget = _get_duration_budget(duration_budget_secs, voices, rate, speech_rate_file)
+    for news in news_list_without_audio:
+        # Number the audios and alternate the voices by the news kept, as the budget estimates
+        audio_path = audio_dir_path / '{}.mp3'.format(str(len(news_list)).zfill(2))
         news_with_audio = sync(
             read_news_with_edge_tts(
                 news=news,
                 audio_path=audio_path,
-                voice=voices[index % len(voices)],
+                voice=voices[len(news_list) % len(voices)],
                 rate=rate,
-                volume=volume))
+                volume=volume,
+                chunked=chunked,
+                gap_secs=sentence_gap_secs,
+                concurrency=tts_concurrency))
         if news_with_audio:
             news_list.append(news_with_audio)
-    write_news_json(news_list, news_json_path)
+        if duration_budget and duration_budget.is_filled(news_list):
+            break
+    if calibrate_speech_rate:
+        _calibrate_speech_rate(news_list, voices, rate, speech_rate_file)
+    if duration_budget:
+        news_list = duration_budget.trim(news_list)
+    _write_news_list(news_list, news_json, news_db, date, NewsStatus.READ,
+                     news_list_without_audio)
+
+
+@main.command()
+@click.option('--news_json', type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_db', type=click.Path(dir_okay=False, exists=True))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
+@click.option('--audio_dir', required=True, type=click.Path(file_okay=False))
+@click.option('--voices', 'voices_str', default=_DEFAULT_VOICES, type=str)
+@click.option('--rate', default=_DEFAULT_RATE, type=str)
+@click.option('--volume', default='+100%', type=str)
+@click.option('--sentence_gap_secs', default=0.3, type=float)
+@click.option('--tts_concurrency', default=4, type=int)
+@click.option(
+    '--duration_budget_secs',
+    type=float,
+    help='Stop summarizing and reading once the measured audios fill the program')
+@click.option(
+    '--speech_rate_file', default=_DEFAULT_SPEECH_RATE_FILE, type=click.Path(dir_okay=False))
+@click.option(
+    '--calibrate_speech_rate',
+    is_flag=True,
+    help='Learn the speech rates from the measured audios into --speech_rate_file')
+def summarize_and_read_news(news_json: Optional[str], news_db: Optional[str], date: str,
+                            audio_dir: str, voices_str: str, rate: str, volume: str,
+                            sentence_gap_secs: float, tts_concurrency: int,
+                            duration_budget_secs: Optional[float], speech_rate_file: str,
+                            calibrate_speech_rate: bool):
+    """Streams each summary into tts, the same as summarize-news and then read-news --chunked."""
+    news_list_without_summary = _read_news_list(news_json, news_db, date)
+    audio_dir_path = Path(audio_dir)
+    audio_dir_path.mkdir(parents=True, exist_ok=True)
+    voices = voices_str.split(',')
+    sync(validate_edge_tts_voices(voices))
+    duration_budget = _get_duration_budget(duration_budget_secs, voices, rate, speech_rate_file)
+    init_openai(_CONFIG['openai_api_key'], _CONFIG['openai_proxy'], _CONFIG.get('openai_pool'))
+    news_list = []
+    for news in news_list_without_summary:
+        if duration_budget and duration_budget.is_filled(news_list):
+            break
+        # Number the audios by the news kept, as read-news does after summarize-news
+        audio_path = audio_dir_path / '{}.mp3'.format(str(len(news_list)).zfill(2))
+        news_with_audio = sync(
+            read_news_summary_stream_with_edge_tts(
+                news=news,
+                brief_content_pieces=iterate_in_thread(stream_news_summary_with_gpt(news=news)),
+                audio_path=audio_path,
+                voice=voices[len(news_list) % len(voices)],
+                rate=rate,
+                volume=volume,
+                gap_secs=sentence_gap_secs,
+                concurrency=tts_concurrency))
+        if news_with_audio:
+            news_list.append(news_with_audio)
+    log_openai_usage()
+    if calibrate_speech_rate:
+        _calibrate_speech_rate(news_list, voices, rate, speech_rate_file)
+    if duration_budget:
+        news_list = duration_budget.trim(news_list)
+    _write_news_list(news_list, news_json, news_db, date, NewsStatus.READ,
+                     news_list_without_summary)
 
 
 @main.command()
@@ -138,35 +364,138 @@ def read_cover_and_ending(cover_audio_file: str, ending_audio_file: str, date: s
 
 
 @main.command()
-@click.option('--news_json', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_json', type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_db', type=click.Path(dir_okay=False, exists=True))
 @click.option('--cover_audio_file', required=True, type=click.Path(dir_okay=False, exists=True))
 @click.option('--ending_audio_file', required=True, type=click.Path(dir_okay=False, exists=True))
 @click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
 @click.option('--video_file', required=True, type=click.Path(dir_okay=False))
 @click.option('--cover_file', required=True, type=click.Path(dir_okay=False))
 @click.option('--description_file', required=True, type=click.Path(dir_okay=False))
-def record_news(news_json: str, cover_audio_file: str, ending_audio_file: str, date: str,
-                video_file: str, cover_file: str, description_file: str):
-    news_json_path = Path(news_json)
+@click.option(
+    '--encoder_profile',
+    type=click.Choice(list(ENCODER_PROFILES.keys())),
+    default=DEFAULT_ENCODER_PROFILE)
+@click.option(
+    '--preview',
+    is_flag=True,
+    help='Only render a quick .preview.mp4 next to the video file for layout checks')
+@click.option('--preview_scale', default=0.5, type=float)
+@click.option('--preview_fps', default=5, type=float)
+@click.option(
+    '--preview_segment_secs', type=float, help='Only preview the beginning of every slide')
+@click.option(
+    '--contact_sheet',
+    is_flag=True,
+    help='With --preview, write a .contact_sheet.png of all slides instead of a video')
+def record_news(news_json: Optional[str], news_db: Optional[str], cover_audio_file: str,
+                ending_audio_file: str, date: str, video_file: str, cover_file: str,
+                description_file: str, encoder_profile: str, preview: bool,
+                preview_scale: float, preview_fps: float, preview_segment_secs: Optional[float],
+                contact_sheet: bool):
+    if contact_sheet and not preview:
+        raise click.UsageError('--contact_sheet only works with --preview.')
     cover_audio_file_path = Path(cover_audio_file)
     ending_audio_file_path = Path(ending_audio_file)
-    news_list = read_news_json(news_json_path)
     video_file_path = Path(video_file)
     video_file_path.parent.mkdir(parents=True, exist_ok=True)
+    if preview:
+        layout_overflows = generate_news_preview(
+            news_list=_read_news_list(news_json, news_db, date),
+            date=date,
+            cover_audio_file_path=cover_audio_file_path,
+            ending_audio_file_path=ending_audio_file_path,
+            font_file_path=Path(_CONFIG['video_font_path']),
+            preview_file_path=None if contact_sheet else video_file_path.with_suffix(
+                '.preview.mp4'),
+            contact_sheet_file_path=video_file_path.with_suffix('.contact_sheet.png')
+            if contact_sheet else None,
+            scale=preview_scale,
+            fps=preview_fps,
+            segment_secs=preview_segment_secs)
+        click.echo(format_layout_report(layout_overflows))
+        return
+    news_list = _read_news_list(news_json, news_db, date)
     cover_file_path = Path(cover_file)
     cover_file_path.parent.mkdir(parents=True, exist_ok=True)
     description_file_path = Path(description_file)
     description_file_path.parent.mkdir(parents=True, exist_ok=True)
-    generate_news_video(
+    layout_overflows = generate_news_video(
         news_list=news_list,
         date=date,
         cover_audio_file_path=cover_audio_file_path,
         ending_audio_file_path=ending_audio_file_path,
         font_file_path=Path(_CONFIG['video_font_path']),
         video_file_path=video_file_path,
-        cover_file_path=cover_file_path)
+        cover_file_path=cover_file_path,
+        encoder_profile_name=encoder_profile)
     generate_news_video_description(
         news_list=news_list, date=date, description_file_path=description_file_path)
+    click.echo(format_layout_report(layout_overflows))
+
+
+@main.command()
+@click.option('--news_json', type=click.Path(dir_okay=False, exists=True))
+@click.option('--news_db', type=click.Path(dir_okay=False, exists=True))
+@click.option('--cover_audio_file', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--ending_audio_file', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
+@click.option('--output_dir', required=True, type=click.Path(file_okay=False))
+@click.option(
+    '--profile',
+    'profiles',
+    type=click.Choice(list(ENCODER_PROFILES.keys())),
+    default=list(ENCODER_PROFILES.keys()),
+    multiple=True)
+@click.option('--duration_secs', type=float, help='Only render the beginning of the edition')
+@click.option('--upload_mbps', default=20, type=float, help='To estimate the upload time')
+def benchmark_encoders(news_json: Optional[str], news_db: Optional[str], cover_audio_file: str,
+                       ending_audio_file: str, date: str, output_dir: str, profiles: List[str],
+                       duration_secs: Optional[float], upload_mbps: float):
+    output_dir_path = Path(output_dir)
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    results = benchmark_encoder_profiles(
+        news_list=_read_news_list(news_json, news_db, date),
+        date=date,
+        cover_audio_file_path=Path(cover_audio_file),
+        ending_audio_file_path=Path(ending_audio_file),
+        font_file_path=Path(_CONFIG['video_font_path']),
+        output_dir_path=output_dir_path,
+        profile_names=list(dict.fromkeys(profiles)),
+        duration_secs=duration_secs)
+    for result in results:
+        result['upload_secs'] = result['file_bytes'] * 8 / (upload_mbps * 1000 * 1000)
+        result['total_secs'] = result['encode_secs'] + result['upload_secs']
+    (output_dir_path / 'benchmark.json').write_text(json.dumps(results, indent=2, sort_keys=True))
+    click.echo('{:<12}{:>12}{:>12}{:>10}{:>12}{:>12}'.format('profile', 'encode_secs', 'size_mb',
+                                                             'psnr', 'upload_secs', 'total_secs'))
+    for result in sorted(results, key=lambda result: result['total_secs']):
+        click.echo('{:<12}{:>12.1f}{:>12.1f}{:>10.2f}{:>12.1f}{:>12.1f}'.format(
+            result['profile'], result['encode_secs'], result['file_bytes'] / 1024 / 1024,
+            result['psnr'], result['upload_secs'], result['total_secs']))
+
+
+@main.command()
+@click.option('--news_db', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
+@click.option('--news_json', required=True, type=click.Path(dir_okay=False))
+def export_news_json(news_db: str, date: str, news_json: str):
+    news_json_path = Path(news_json)
+    news_json_path.parent.mkdir(parents=True, exist_ok=True)
+    news_store = NewsStore(Path(news_db))
+    news_store.export_news_json(date, news_json_path)
+    news_store.close()
+
+
+@main.command()
+@click.option('--news_db', required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option('--url', required=True, type=str)
+@click.option('--since_date', default='', type=str)
+def find_news(news_db: str, url: str, since_date: str):
+    news_store = NewsStore(Path(news_db))
+    for date in news_store.find_dates_by_url(url, since_date):
+        click.echo(date)
+    news_store.close()
 
 
 if __name__ == '__main__':
@@ -3,11 +3,19 @@
 import asyncio
 import logging
 import re
-from typing import Any, Coroutine
+import threading
+from typing import Any, AsyncIterator, Coroutine, Iterator, TypeVar
+
+_T = TypeVar('_T')
+_END_OF_ITERATOR = object()
 
 
 def setup_logging(logging_level=logging.INFO):
     logger = logging.getLogger()
+    # Commands may be invoked many times in one process, e.g. by the daemon
+    if logger.handlers:
+        logger.setLevel(logging_level)
+        return
     handler = logging.StreamHandler()
     handler.setFormatter(
         logging.Formatter('%(asctime)s [%(filename)s:%(lineno)d] [%(levelname)s] %(message)s'))
@@ -29,6 +37,29 @@ def sync(coroutine: Coroutine) -> Any:
     return loop.run_until_complete(coroutine)
 
 
+async def iterate_in_thread(iterator: Iterator[_T]) -> AsyncIterator[_T]:
+    """Iterates a blocking iterator in a thread, so that the event loop keeps running."""
+    loop = asyncio.get_event_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as exception:  # pylint: disable=broad-except
+            loop.call_soon_threadsafe(queue.put_nowait, exception)
+        loop.call_soon_threadsafe(queue.put_nowait, _END_OF_ITERATOR)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = await queue.get()
+        if item is _END_OF_ITERATOR:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
 def count_chinese_chars(txt: str):
     visible_chars = re.sub(r'\s+', '', txt, flags=re.UNICODE)
     return len(visible_chars)
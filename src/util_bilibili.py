@@ -1,10 +1,31 @@
 # Copyright @2023. All rights reserved.
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import hashlib
+import json
 import logging
+import time
+from enum import Enum
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from bilibili_api import sync, homepage, video_uploader, Credential
+import requests
+from bilibili_api import sync, video_uploader, Credential
+
+from util_bilibili_upload import upload_video_in_chunks
+from util_request import request_get
+
+# A minimal authenticated endpoint, which answers code -101 for invalid cookies
+_NAV_URL = 'https://api.bilibili.com/x/web-interface/nav'
+_NAV_NOT_LOGIN_CODE = -101
+_CREDENTIAL_CHECK_TIMEOUT_SECS = 5
+_CREDENTIAL_CHECK_RETRY_TIMES = 2
+_DEFAULT_CREDENTIAL_CACHE_TTL_SECS = 3600
+
+
+class CredentialStatus(Enum):
+    VALID = 'valid'
+    INVALID = 'invalid'
+    NETWORK_ERROR = 'network_error'
 
 
 class UtilBilibili():
@@ -17,15 +38,91 @@ class UtilBilibili():
         cls.is_initialized = True
 
     @classmethod
-    def check_login(cls) -> bool:
-        if not cls.is_initialized:
-            return False
+    def _get_credential_hash(cls) -> str:
+        # Never persist the cookies themselves, only a digest to detect that they changed
+        return hashlib.sha256('{}|{}|{}'.format(cls.credential.sessdata, cls.credential.bili_jct,
+                                                cls.credential.buvid3).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _read_cached_credential_status(cls, cache_file_path: Path,
+                                       ttl_secs: float) -> Optional[CredentialStatus]:
+        if not cache_file_path.exists():
+            return None
+        try:
+            cache = json.loads(cache_file_path.read_text(encoding='utf-8'))
+            if cache['credential_hash'] != cls._get_credential_hash():
+                return None
+            if time.time() - cache['checked_timestamp'] > ttl_secs:
+                return None
+            return CredentialStatus(cache['status'])
+        except Exception as exception:  # pylint: disable=broad-except
+            logging.warning('Ignore the broken credential cache file {}: {}'.format(
+                str(cache_file_path), exception))
+            return None
+
+    @classmethod
+    def _write_cached_credential_status(cls, cache_file_path: Path, status: CredentialStatus):
+        cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_file_path.write_text(
+            json.dumps(
+                {
+                    'credential_hash': cls._get_credential_hash(),
+                    'checked_timestamp': time.time(),
+                    'status': status.value,
+                },
+                indent=2,
+                sort_keys=True),
+            encoding='utf-8')
+
+    @classmethod
+    def _request_credential_status(cls) -> CredentialStatus:
         try:
-            sync(homepage.get_videos())
-        except:  # pylint: disable=bare-except
-            return False
-        else:
-            return True
+            response = request_get(
+                url=_NAV_URL,
+                extra_headers={
+                    'Cookie':
+                    'SESSDATA={}; bili_jct={}; buvid3={}'.format(cls.credential.sessdata,
+                                                                 cls.credential.bili_jct,
+                                                                 cls.credential.buvid3),
+                },
+                timeout=_CREDENTIAL_CHECK_TIMEOUT_SECS,
+                retry_times=_CREDENTIAL_CHECK_RETRY_TIMES)
+            response.raise_for_status()
+            response_json = response.json()
+        except (requests.exceptions.RequestException, ValueError) as exception:
+            logging.warning('Failed to check bilibili credential: {}'.format(exception))
+            return CredentialStatus.NETWORK_ERROR
+        if response_json.get('code') == 0 and response_json.get('data', {}).get('isLogin'):
+            return CredentialStatus.VALID
+        if response_json.get('code') in (0, _NAV_NOT_LOGIN_CODE):
+            return CredentialStatus.INVALID
+        logging.warning('Unexpected response when checking bilibili credential: {}'.format(
+            json.dumps(response_json, ensure_ascii=False)))
+        return CredentialStatus.NETWORK_ERROR
+
+    @classmethod
+    def check_credential(
+            cls,
+            cache_file_path: Optional[Path] = None,
+            ttl_secs: float = _DEFAULT_CREDENTIAL_CACHE_TTL_SECS) -> CredentialStatus:
+        if not cls.is_initialized:
+            return CredentialStatus.INVALID
+        if cache_file_path is not None:
+            cached_status = cls._read_cached_credential_status(cache_file_path, ttl_secs)
+            if cached_status is not None:
+                logging.info('Use the cached bilibili credential status: {}'.format(
+                    cached_status.value))
+                return cached_status
+        status = cls._request_credential_status()
+        # Transient network errors say nothing about the cookies, so never cache them
+        if cache_file_path is not None and status != CredentialStatus.NETWORK_ERROR:
+            cls._write_cached_credential_status(cache_file_path, status)
+        logging.info('Checked bilibili credential status: {}'.format(status.value))
+        return status
+
+    @classmethod
+    def check_login(cls) -> bool:
+        return cls.check_credential() == CredentialStatus.VALID
 
     @classmethod
     async def _upload(cls, video_file_path: Path, cover_file_path: Path, title: str,
@@ -42,15 +139,9 @@ class UtilBilibili():
         await uploader.start()
 
     @classmethod
-    def upload(cls,
-               video_file_path: Path,
-               cover_file_path: Path,
-               title: str,
-               description: str,
-               tags: List[str],
-               tid: int = 124):
+    def _get_metadata(cls, title: str, description: str, tags: List[str], tid: int) -> dict:
         # ref: https://nemo2011.github.io/bilibili-api/#/modules/video_uploader
-        metadata = {
+        return {
             'act_reserve_create': 0,
             'copyright': 1,
             'source': '',
@@ -73,8 +164,41 @@ class UtilBilibili():
             'up_selection_reply': False,
             'dtime': 0,
         }
+
+    @classmethod
+    def upload(cls,
+               video_file_path: Path,
+               cover_file_path: Path,
+               title: str,
+               description: str,
+               tags: List[str],
+               tid: int = 124):
+        metadata = cls._get_metadata(title=title, description=description, tags=tags, tid=tid)
         try:
             sync(cls._upload(video_file_path, cover_file_path, title, description, metadata))
-        except Exception as exception:  # pylint: disable=broad-except
+        except Exception as exception:
             logging.exception('Failed to upload {} to bilibili: {}'.format(
                 str(video_file_path), exception))
+            raise
+
+    @classmethod
+    def upload_in_chunks(cls,
+                         video_file_path: Path,
+                         cover_file_path: Path,
+                         title: str,
+                         description: str,
+                         tags: List[str],
+                         state_file_path: Path,
+                         threads: int,
+                         tid: int = 124) -> str:
+        metadata = cls._get_metadata(title=title, description=description, tags=tags, tid=tid)
+        return upload_video_in_chunks(
+            sessdata=cls.credential.sessdata,
+            bili_jct=cls.credential.bili_jct,
+            buvid3=cls.credential.buvid3,
+            video_file_path=video_file_path,
+            cover_file_path=cover_file_path,
+            title=title,
+            metadata=metadata,
+            state_file_path=state_file_path,
+            threads=threads)
@@ -0,0 +1,356 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import base64
+import dataclasses
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import requests
+from retry.api import retry_call
+
+from util_request import request_get, request_post, request_put
+
+# ref: https://github.com/Nemo2011/bilibili-api/blob/main/bilibili_api/video_uploader.py
+_PREUPLOAD_URL = 'https://member.bilibili.com/preupload'
+_COVER_UPLOAD_URL = 'https://member.bilibili.com/x/vu/web/cover/up'
+_SUBMIT_URL = 'https://member.bilibili.com/x/vu/web/add'
+_UPOS_PROFILE = 'ugcfx/bup'
+_UPOS_CHUNK_SUCCESS_TEXTS = ('MULTIPART_PUT_SUCCESS', '')
+_BILI_HEADERS = {
+    'Referer': 'https://www.bilibili.com',
+}
+_CHUNK_RETRY_TIMES = 5
+_CHUNK_RETRY_DELAY = 1
+_CHUNK_RETRY_BACKOFF = 2
+_CHUNK_TIMEOUT_SECS = 120
+_BYTES_PER_MB = 1024 * 1024
+
+
+@dataclass
+class UploadState():
+    """The resumable state of a chunked upload, persisted as json after every confirmed chunk."""
+    video_size: int
+    video_mtime: float
+    auth: str
+    endpoint: str
+    upos_uri: str
+    biz_id: int
+    chunk_size: int
+    upload_id: str
+    finished_chunks: List[int] = field(default_factory=list)
+    filename: str = ''
+    cover_url: str = ''
+    bvid: str = ''
+
+    @property
+    def upload_url(self) -> str:
+        return 'https:{}/{}'.format(self.endpoint, self.upos_uri.replace('upos://', '', 1))
+
+    @property
+    def chunks_num(self) -> int:
+        return math.ceil(self.video_size / self.chunk_size)
+
+    def as_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def read_upload_state(state_file_path: Path) -> Optional[UploadState]:
+    if not state_file_path.exists():
+        return None
+    try:
+        return UploadState(**json.loads(state_file_path.read_text(encoding='utf-8')))
+    except Exception as exception:  # pylint: disable=broad-except
+        logging.warning('Ignore the broken upload state file {}: {}'.format(
+            str(state_file_path), exception))
+        return None
+
+
+def write_upload_state(state: UploadState, state_file_path: Path):
+    # Write to a temp file then rename, so that a crash never leaves a half-written state
+    temp_state_file_path = state_file_path.with_suffix(state_file_path.suffix + '.tmp')
+    temp_state_file_path.write_text(
+        json.dumps(state.as_dict(), indent=2, sort_keys=True), encoding='utf-8')
+    temp_state_file_path.replace(state_file_path)
+
+
+class ChunkedUploader():
+    """Uploads a video to bilibili's upos storage in parallel chunks and submits it.
+
+    The upload can be resumed from the state file after the process is restarted.
+    """
+
+    def __init__(self, sessdata: str, bili_jct: str, buvid3: str, state_file_path: Path,
+                 threads: int):
+        self.bili_jct = bili_jct
+        self.cookie_headers = {
+            'Cookie': 'SESSDATA={}; bili_jct={}; buvid3={}'.format(sessdata, bili_jct, buvid3),
+        }
+        self.state_file_path = state_file_path
+        self.threads = max(threads, 1)
+        self.state: Optional[UploadState] = None
+        self._state_lock = threading.Lock()
+        self._uploaded_bytes = 0
+        self._start_time = 0.0
+
+    def _preupload(self, video_file_path: Path) -> UploadState:
+        video_size = video_file_path.stat().st_size
+        preupload_response = request_get(
+            url=_PREUPLOAD_URL,
+            params={
+                'profile': _UPOS_PROFILE,
+                'name': video_file_path.name,
+                'size': video_size,
+                'r': 'upos',
+                'ssl': '0',
+                'version': '2.10.4',
+                'build': '2100400',
+                'upcdn': 'bda2',
+                'probe_version': '20211012',
+            },
+            extra_headers={
+                **_BILI_HEADERS,
+                **self.cookie_headers,
+            })
+        preupload = preupload_response.json()
+        if preupload.get('OK') != 1:
+            raise ValueError('Failed to preupload {}: {}'.format(
+                str(video_file_path), json.dumps(preupload)))
+        state = UploadState(
+            video_size=video_size,
+            video_mtime=video_file_path.stat().st_mtime,
+            auth=preupload['auth'],
+            endpoint=preupload.get('endpoint') or preupload['endpoints'][0],
+            upos_uri=preupload['upos_uri'],
+            biz_id=preupload['biz_id'],
+            chunk_size=preupload['chunk_size'],
+            upload_id='')
+
+        upload_id_response = request_post(
+            url=state.upload_url,
+            params={
+                'uploads': '',
+                'output': 'json',
+                'profile': _UPOS_PROFILE,
+                'filesize': state.video_size,
+                'partsize': state.chunk_size,
+                'biz_id': state.biz_id,
+            },
+            extra_headers={
+                **_BILI_HEADERS,
+                'x-upos-auth': state.auth,
+            })
+        upload_id_json = upload_id_response.json()
+        if upload_id_json.get('OK') != 1:
+            raise ValueError('Failed to get upload id for {}: {}'.format(
+                str(video_file_path), json.dumps(upload_id_json)))
+        state.upload_id = upload_id_json['upload_id']
+        logging.info('Preuploaded {} with {} chunks of {} bytes'.format(
+            str(video_file_path), state.chunks_num, state.chunk_size))
+        return state
+
+    def _load_or_create_state(self, video_file_path: Path) -> UploadState:
+        state = read_upload_state(self.state_file_path)
+        video_stat = video_file_path.stat()
+        if state is not None and (state.video_size != video_stat.st_size or
+                                  state.video_mtime != video_stat.st_mtime):
+            logging.warning('The video {} has changed since the last upload, restart it.'.format(
+                str(video_file_path)))
+            state = None
+        if state is None:
+            state = self._preupload(video_file_path)
+            write_upload_state(state, self.state_file_path)
+        else:
+            logging.info('Resume uploading {} with {}/{} chunks finished'.format(
+                str(video_file_path), len(state.finished_chunks), state.chunks_num))
+        return state
+
+    def _put_chunk(self, chunk: bytes, chunk_index: int):
+        state = self.state
+        response = request_put(
+            url=state.upload_url,
+            data=chunk,
+            params={
+                'partNumber': chunk_index + 1,
+                'uploadId': state.upload_id,
+                'chunk': chunk_index,
+                'chunks': state.chunks_num,
+                'size': len(chunk),
+                'start': chunk_index * state.chunk_size,
+                'end': chunk_index * state.chunk_size + len(chunk),
+                'total': state.video_size,
+            },
+            extra_headers={'x-upos-auth': state.auth},
+            timeout=_CHUNK_TIMEOUT_SECS,
+            retry_times=1,
+            # Chunks are retried on their own, a burst of failed ones must not fail the upload
+            circuit_breaker=False)
+        response.raise_for_status()
+        if response.text not in _UPOS_CHUNK_SUCCESS_TEXTS:
+            raise requests.exceptions.HTTPError('Unexpected chunk response: {}'.format(
+                response.text))
+
+    def _upload_chunk(self, video_file_path: Path, chunk_index: int):
+        state = self.state
+        with open(video_file_path, 'rb') as video_file:
+            video_file.seek(chunk_index * state.chunk_size)
+            chunk = video_file.read(state.chunk_size)
+        retry_call(
+            self._put_chunk,
+            fargs=[chunk, chunk_index],
+            exceptions=(requests.exceptions.RequestException, requests.exceptions.HTTPError),
+            tries=_CHUNK_RETRY_TIMES,
+            delay=_CHUNK_RETRY_DELAY,
+            backoff=_CHUNK_RETRY_BACKOFF)
+        with self._state_lock:
+            state.finished_chunks.append(chunk_index)
+            write_upload_state(state, self.state_file_path)
+            self._uploaded_bytes += len(chunk)
+            elapsed_secs = max(time.time() - self._start_time, 1e-6)
+            logging.info('Uploaded chunk {}/{} ({:.1f}%) of {}, {:.2f} MB/s'.format(
+                chunk_index + 1, state.chunks_num,
+                len(state.finished_chunks) / state.chunks_num * 100, str(video_file_path),
+                self._uploaded_bytes / _BYTES_PER_MB / elapsed_secs))
+
+    def _complete(self, video_file_path: Path):
+        state = self.state
+        response = request_post(
+            url=state.upload_url,
+            data=json.dumps({
+                'parts': [{
+                    'partNumber': index + 1,
+                    'eTag': 'etag',
+                } for index in range(state.chunks_num)]
+            }),
+            params={
+                'output': 'json',
+                'name': video_file_path.name,
+                'profile': _UPOS_PROFILE,
+                'uploadId': state.upload_id,
+                'biz_id': state.biz_id,
+            },
+            extra_headers={
+                'x-upos-auth': state.auth,
+                'Content-Type': 'application/json; charset=UTF-8',
+            })
+        response_json = response.json()
+        if response_json.get('OK') != 1:
+            raise ValueError('Failed to complete the upload of {}: {}'.format(
+                str(video_file_path), json.dumps(response_json)))
+        state.filename = Path(response_json['key'].lstrip('/')).stem
+
+    def prepare(self, video_file_path: Path):
+        """Resumes the upload of the video from the state file, or preuploads it."""
+        self.state = self._load_or_create_state(video_file_path)
+
+    def upload_video(self, video_file_path: Path):
+        if self.state is None:
+            self.prepare(video_file_path)
+        if self.state.filename:
+            logging.info('The video {} has already been uploaded as {}'.format(
+                str(video_file_path), self.state.filename))
+            return
+        finished_chunks = set(self.state.finished_chunks)
+        pending_chunks = [
+            index for index in range(self.state.chunks_num) if index not in finished_chunks
+        ]
+        self._uploaded_bytes = 0
+        self._start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [
+                executor.submit(self._upload_chunk, video_file_path, index)
+                for index in pending_chunks
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Raise the first failure without uploading the queued chunks, the finished
+                # ones are kept in the state file
+                executor.shutdown(cancel_futures=True)
+                raise
+        self._complete(video_file_path)
+        write_upload_state(self.state, self.state_file_path)
+        logging.info('Uploaded {} in {:.1f} secs'.format(
+            str(video_file_path),
+            time.time() - self._start_time))
+
+    def upload_cover(self, cover_file_path: Path):
+        if self.state.cover_url:
+            return
+        cover_base64 = base64.b64encode(cover_file_path.read_bytes()).decode('utf-8')
+        response = request_post(
+            url=_COVER_UPLOAD_URL,
+            data={
+                'cover': 'data:image/png;base64,{}'.format(cover_base64),
+                'csrf': self.bili_jct,
+            },
+            extra_headers={
+                **_BILI_HEADERS,
+                **self.cookie_headers,
+            })
+        response_json = response.json()
+        if response_json.get('code') != 0:
+            raise ValueError('Failed to upload cover {}: {}'.format(
+                str(cover_file_path), json.dumps(response_json, ensure_ascii=False)))
+        self.state.cover_url = response_json['data']['url']
+        write_upload_state(self.state, self.state_file_path)
+        logging.info('Uploaded cover {} to {}'.format(str(cover_file_path),
+                                                      self.state.cover_url))
+
+    def submit(self, title: str, metadata: dict) -> str:
+        if self.state.bvid:
+            logging.info('The video has already been submitted as {}'.format(self.state.bvid))
+            return self.state.bvid
+        response = request_post(
+            url=_SUBMIT_URL,
+            data=json.dumps({
+                **metadata,
+                'cover': self.state.cover_url,
+                'videos': [{
+                    'title': title,
+                    'desc': '',
+                    'filename': self.state.filename,
+                    'cid': self.state.biz_id,
+                }],
+            }),
+            params={'csrf': self.bili_jct},
+            extra_headers={
+                **_BILI_HEADERS,
+                **self.cookie_headers,
+                'Content-Type': 'application/json',
+            })
+        response_json = response.json()
+        if response_json.get('code') != 0:
+            raise ValueError('Failed to submit the video: {}'.format(
+                json.dumps(response_json, ensure_ascii=False)))
+        self.state.bvid = response_json['data']['bvid']
+        write_upload_state(self.state, self.state_file_path)
+        logging.info('Submitted the video as {}'.format(self.state.bvid))
+        return self.state.bvid
+
+
+def upload_video_in_chunks(sessdata: str, bili_jct: str, buvid3: str, video_file_path: Path,
+                           cover_file_path: Path, title: str, metadata: dict,
+                           state_file_path: Path, threads: int) -> str:
+    uploader = ChunkedUploader(
+        sessdata=sessdata,
+        bili_jct=bili_jct,
+        buvid3=buvid3,
+        state_file_path=state_file_path,
+        threads=threads)
+    uploader.prepare(video_file_path)
+    # Before the chunks, so that a bad cover fails fast and a resumed upload never sends it again
+    uploader.upload_cover(cover_file_path)
+    uploader.upload_video(video_file_path)
+    return uploader.submit(title=title, metadata=metadata)
+
+
+def get_default_upload_state_file_path(video_file_path: Path) -> Path:
+    return video_file_path.with_name(video_file_path.name + '.upload.json')
@@ -0,0 +1,117 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import logging
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from class_news import News
+
+_SHINGLE_SIZE = 3
+_NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows make pairs with a jaccard similarity above ~0.5 likely to share a bucket
+_NUM_BANDS = 16
+_MERSENNE_PRIME = (1 << 31) - 1
+_RANDOM_SEED = 20230501
+
+
+def _get_shingle_hashes(txt: str) -> np.ndarray:
+    normalized_txt = re.sub(r'[\W_]+', '', txt.lower(), flags=re.UNICODE)
+    if len(normalized_txt) <= _SHINGLE_SIZE:
+        shingles = {normalized_txt}
+    else:
+        shingles = {
+            normalized_txt[index:index + _SHINGLE_SIZE]
+            for index in range(len(normalized_txt) - _SHINGLE_SIZE + 1)
+        }
+    return np.array([zlib.crc32(shingle.encode('utf-8')) % _MERSENNE_PRIME for shingle in shingles],
+                    dtype=np.uint64)
+
+
+class NearDuplicateIndex():
+    """An in-memory MinHash LSH index, which finds near duplicates without pairwise comparisons."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        # The legacy generator, whose seeded draws stay the same across numpy versions
+        random_state = np.random.RandomState(_RANDOM_SEED)  # pylint: disable=no-member
+        self._perm_a = random_state.randint(1, _MERSENNE_PRIME, size=(_NUM_PERMUTATIONS, 1),
+                                            dtype=np.uint64)
+        self._perm_b = random_state.randint(0, _MERSENNE_PRIME, size=(_NUM_PERMUTATIONS, 1),
+                                            dtype=np.uint64)
+        self._rows_per_band = _NUM_PERMUTATIONS // _NUM_BANDS
+        self._buckets: Dict[Tuple[int, bytes], List[str]] = defaultdict(list)
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def _get_signature(self, txt: str) -> np.ndarray:
+        shingle_hashes = _get_shingle_hashes(txt)
+        # Both operands are below 2^31, so the products never overflow uint64
+        permuted_hashes = (self._perm_a * shingle_hashes + self._perm_b) % _MERSENNE_PRIME
+        return permuted_hashes.min(axis=1)
+
+    def _get_band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band,
+                 signature[band * self._rows_per_band:(band + 1) * self._rows_per_band].tobytes())
+                for band in range(_NUM_BANDS)]
+
+    def query(self, txt: str) -> Optional[Tuple[str, float]]:
+        """Returns the key and estimated similarity of the most similar indexed text if any."""
+        signature = self._get_signature(txt)
+        candidate_keys = {
+            key for band_key in self._get_band_keys(signature) for key in self._buckets[band_key]
+        }
+        best_key: Optional[str] = None
+        best_similarity = 0.0
+        for key in candidate_keys:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= self.threshold and (best_key is None or similarity > best_similarity):
+                best_key, best_similarity = key, similarity
+        return None if best_key is None else (best_key, best_similarity)
+
+    def add(self, key: str, txt: str):
+        signature = self._get_signature(txt)
+        self._signatures[key] = signature
+        for band_key in self._get_band_keys(signature):
+            self._buckets[band_key].append(key)
+
+
+class NearDuplicateNewsFilter():
+    """Keeps the first news of every near-duplicate cluster.
+
+    Feed the news in comment count desc, so that the most commented one of a story is kept.
+    """
+
+    def __init__(self, threshold: float, with_content: bool):
+        self.with_content = with_content
+        self._index = NearDuplicateIndex(threshold=threshold)
+        self._titles: Dict[str, str] = {}
+        self._clusters: Dict[str, List[str]] = defaultdict(list)
+
+    def is_duplicate(self, news: News) -> bool:
+        txt = '{}\n{}'.format(news.title, news.content) if self.with_content else news.title
+        match = self._index.query(txt)
+        if match is not None:
+            kept_url, similarity = match
+            self._clusters[kept_url].append(news.title)
+            logging.info('Skip the near-duplicate news {} of {} with similarity {:.2f}'.format(
+                news.title, self._titles[kept_url], similarity))
+            return True
+        self._index.add(news.url, txt)
+        self._titles[news.url] = news.title
+        return False
+
+    def log_clusters(self):
+        for kept_url, merged_titles in self._clusters.items():
+            logging.info('Merged near-duplicate news into {}: {}'.format(
+                self._titles[kept_url], ', '.join(merged_titles)))
+
+
+def remove_near_duplicate_news(news_list: List[News], threshold: float,
+                               with_content: bool) -> List[News]:
+    news_filter = NearDuplicateNewsFilter(threshold=threshold, with_content=with_content)
+    deduplicated_news_list = [news for news in news_list if not news_filter.is_duplicate(news)]
+    news_filter.log_clusters()
+    return deduplicated_news_list
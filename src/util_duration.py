@@ -0,0 +1,162 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import fcntl
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from class_news import News
+from util import count_chinese_chars
+
+# Before any calibration, roughly the speed of edge-tts chinese voices at rate +0%
+_DEFAULT_CHARS_PER_SEC = 4.5
+_DEFAULT_BRIEF_CHARS = 100
+# The silence before and after the audio of every slide, as in util_video
+_SLIDE_SILENCE_SECS = 2
+# Estimated length of the cover and the ending with their silences
+_COVER_AND_ENDING_SECS = 25
+# Weight of the previous calibration, so that it follows changes of voices slowly
+_CALIBRATION_DECAY = 0.9
+_RATE_PATTERN = re.compile(r'^([+-]\d+(?:\.\d+)?)%$')
+
+
+def _get_rate_factor(rate: str) -> float:
+    """Returns the speed of an edge-tts rate like '+10%' relative to '+0%'."""
+    match = _RATE_PATTERN.match(rate)
+    if not match:
+        raise ValueError('Invalid edge-tts rate {}'.format(rate))
+    return 1 + float(match.group(1)) / 100
+
+
+def _get_spoken_chars(news: News) -> int:
+    return count_chinese_chars(news.title) + count_chinese_chars(news.brief_content)
+
+
+class SpeechRateCalibration():
+    """Speech rates per voice and the mean summary length, learned from the measured audios.
+
+    Persisted as json, e.g. data/speech_rate.json, and shared by all editions.
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        # Chars and secs at rate +0% of every voice, and chars and count of the summaries
+        self.voices, self.brief = self._load()
+
+    def _load(self) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+        calibration = {}
+        if self.file_path.exists():
+            calibration = json.loads(self.file_path.read_text(encoding='utf-8'))
+        return calibration.get('voices', {}), calibration.get('brief', {})
+
+    def get_chars_per_sec(self, voice: str) -> float:
+        voice_calibration = self.voices.get(voice)
+        if not voice_calibration or not voice_calibration['secs']:
+            return _DEFAULT_CHARS_PER_SEC
+        return voice_calibration['chars'] / voice_calibration['secs']
+
+    def get_brief_chars(self) -> float:
+        if not self.brief or not self.brief['count']:
+            return _DEFAULT_BRIEF_CHARS
+        return self.brief['chars'] / self.brief['count']
+
+    def update(self, news_list: List[News], voices: List[str], rate: str):
+        """Learns from the news read with their voices at the rate, then saves the file.
+
+        Concurrent editions may update the same file, so the read-modify-write holds a lock on
+        a .lock file next to it, and the file is replaced atomically.
+        """
+        rate_factor = _get_rate_factor(rate)
+        voice_samples: Dict[str, Dict[str, float]] = {}
+        for news, voice in zip(news_list, voices):
+            if news.audio_duration <= 0:
+                continue
+            voice_sample = voice_samples.setdefault(voice, {
+                'chars': 0.0,
+                'secs': 0.0
+            })
+            voice_sample['chars'] += _get_spoken_chars(news)
+            voice_sample['secs'] += news.audio_duration * rate_factor
+        brief_chars = [count_chinese_chars(news.brief_content) for news in news_list]
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file_path = self.file_path.with_suffix(self.file_path.suffix + '.lock')
+        with open(lock_file_path, 'w', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Reload under the lock, so that an update saved since the constructor is not lost
+            self.voices, self.brief = self._load()
+            for voice, voice_sample in voice_samples.items():
+                voice_calibration = self.voices.get(voice, {'chars': 0.0, 'secs': 0.0})
+                self.voices[voice] = {
+                    key: voice_calibration[key] * _CALIBRATION_DECAY + voice_sample[key]
+                    for key in ('chars', 'secs')
+                }
+            if brief_chars:
+                self.brief = {
+                    'chars': self.brief.get('chars', 0.0) * _CALIBRATION_DECAY + sum(brief_chars),
+                    'count': self.brief.get('count', 0.0) * _CALIBRATION_DECAY + len(brief_chars),
+                }
+            temp_file_path = self.file_path.with_suffix(self.file_path.suffix + '.tmp')
+            temp_file_path.write_text(
+                json.dumps({
+                    'voices': self.voices,
+                    'brief': self.brief
+                }, indent=2, sort_keys=True),
+                encoding='utf-8')
+            temp_file_path.replace(self.file_path)
+        logging.info('Calibrated speech rates: {}'.format(', '.join([
+            '{} {:.2f} chars/sec'.format(voice, self.get_chars_per_sec(voice))
+            for voice in voice_samples
+        ])))
+
+
+class DurationBudget():
+    """The target length of the program, against which news are selected in every stage.
+
+    A news is estimated by its measured audio once read, by its summary once summarized, and by
+    its title plus the mean summary length before that.
+    """
+
+    def __init__(self, total_secs: float, voices: List[str], rate: str,
+                 calibration: SpeechRateCalibration):
+        if total_secs <= _COVER_AND_ENDING_SECS:
+            raise ValueError('The duration budget {} secs leaves no time beyond the {} secs of '
+                             'the cover and the ending'.format(total_secs, _COVER_AND_ENDING_SECS))
+        self.news_secs = total_secs - _COVER_AND_ENDING_SECS
+        self.voices = voices
+        self.rate_factor = _get_rate_factor(rate)
+        self.calibration = calibration
+
+    def estimate_secs(self, news: News, index: int) -> float:
+        if news.audio_duration > 0:
+            return news.audio_duration + _SLIDE_SILENCE_SECS
+        spoken_chars = _get_spoken_chars(news)
+        if not news.brief_content:
+            spoken_chars += self.calibration.get_brief_chars()
+        chars_per_sec = self.calibration.get_chars_per_sec(self.voices[index % len(self.voices)])
+        return spoken_chars / (chars_per_sec * self.rate_factor) + _SLIDE_SILENCE_SECS
+
+    def is_filled(self, news_list: List[News], reserve_num: int = 0) -> bool:
+        """Returns whether the news fill the budget, with reserve_num more news after them."""
+        total_secs = 0.0
+        for index, news in enumerate(news_list):
+            total_secs += self.estimate_secs(news, index)
+            if total_secs >= self.news_secs:
+                return len(news_list) - (index + 1) >= reserve_num
+        return False
+
+    def trim(self, news_list: List[News]) -> List[News]:
+        """Keeps the leading news whose total is the closest to the budget, at least one."""
+        kept_news_list: List[News] = []
+        total_secs = 0.0
+        for index, news in enumerate(news_list):
+            news_secs = self.estimate_secs(news, index)
+            if kept_news_list and abs(total_secs + news_secs - self.news_secs) > abs(
+                    total_secs - self.news_secs):
+                break
+            kept_news_list.append(news)
+            total_secs += news_secs
+        logging.info('Selected {}/{} news for an estimated {:.0f}/{:.0f} secs of news'.format(
+            len(kept_news_list), len(news_list), total_secs, self.news_secs))
+        return kept_news_list
@@ -0,0 +1,137 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List
+
+from util_news import read_news_json
+
+
+class EditionStage(Enum):
+    FETCH_NEWS = 'fetch-news'
+    SUMMARIZE_NEWS = 'summarize-news'
+    READ_NEWS = 'read-news'
+    READ_COVER_AND_ENDING = 'read-cover-and-ending'
+    RECORD_NEWS = 'record-news'
+    UPLOAD_TO_BILIBILI = 'upload-to-bilibili'
+
+
+GENERATOR_STAGES = [
+    EditionStage.FETCH_NEWS,
+    EditionStage.SUMMARIZE_NEWS,
+    EditionStage.READ_NEWS,
+    EditionStage.READ_COVER_AND_ENDING,
+    EditionStage.RECORD_NEWS,
+]
+
+
+@dataclass
+class Edition():
+    """An edition of the program with the same files layout as generator.sh."""
+    date: str
+    data_dir_path: Path
+    # HHMM of an intra-day edition, empty for the daily one
+    edition_time: str = ''
+
+    @property
+    def news_json_path(self) -> Path:
+        return self.data_dir_path / 'news.json'
+
+    @property
+    def image_dir_path(self) -> Path:
+        return self.data_dir_path / 'images'
+
+    @property
+    def audio_dir_path(self) -> Path:
+        return self.data_dir_path / 'audios'
+
+    @property
+    def cover_audio_file_path(self) -> Path:
+        return self.audio_dir_path / 'cover.mp3'
+
+    @property
+    def ending_audio_file_path(self) -> Path:
+        return self.audio_dir_path / 'ending.mp3'
+
+    @property
+    def video_file_path(self) -> Path:
+        return self.data_dir_path / 'video.mp4'
+
+    @property
+    def cover_file_path(self) -> Path:
+        return self.data_dir_path / 'cover.png'
+
+    @property
+    def description_file_path(self) -> Path:
+        return self.data_dir_path / 'description.txt'
+
+    def _get_stage_artifact_paths(self) -> Dict[EditionStage, List[Path]]:
+        return {
+            EditionStage.FETCH_NEWS: [self.news_json_path],
+            EditionStage.SUMMARIZE_NEWS: [self.news_json_path],
+            EditionStage.READ_NEWS: [self.news_json_path],
+            EditionStage.READ_COVER_AND_ENDING: [
+                self.cover_audio_file_path, self.ending_audio_file_path
+            ],
+            EditionStage.RECORD_NEWS: [
+                self.video_file_path, self.cover_file_path, self.description_file_path
+            ],
+            # Whether a video was uploaded is not recorded in the data dir
+            EditionStage.UPLOAD_TO_BILIBILI: [],
+        }
+
+    def has_stage_artifacts(self, stage: EditionStage) -> bool:
+        """Returns whether the files produced by the stage are all present."""
+        artifact_paths = self._get_stage_artifact_paths()[stage]
+        if not artifact_paths or not all(path.exists() for path in artifact_paths):
+            return False
+        if stage not in (EditionStage.SUMMARIZE_NEWS, EditionStage.READ_NEWS):
+            return True
+        # These stages fill the news json in place, so check each news of it
+        news_list = read_news_json(self.news_json_path)
+        if stage == EditionStage.SUMMARIZE_NEWS:
+            return bool(news_list) and all(news.brief_content for news in news_list)
+        return bool(news_list) and all(
+            news.audio_path and Path(news.audio_path).exists() for news in news_list)
+
+    def get_stage_args(self, stage: EditionStage) -> List[str]:
+        """Returns the command line args of the stage, the same as generator.sh runs."""
+        if stage == EditionStage.FETCH_NEWS:
+            return [
+                stage.value, '--news_json',
+                str(self.news_json_path), '--image_dir',
+                str(self.image_dir_path), '--date', self.date
+            ]
+        if stage == EditionStage.SUMMARIZE_NEWS:
+            return [stage.value, '--news_json', str(self.news_json_path), '--date', self.date]
+        if stage == EditionStage.READ_NEWS:
+            return [
+                stage.value, '--news_json',
+                str(self.news_json_path), '--audio_dir',
+                str(self.audio_dir_path), '--date', self.date
+            ]
+        if stage == EditionStage.READ_COVER_AND_ENDING:
+            return [
+                stage.value, '--cover_audio_file',
+                str(self.cover_audio_file_path), '--ending_audio_file',
+                str(self.ending_audio_file_path), '--rate', '-5%', '--date', self.date
+            ]
+        if stage == EditionStage.RECORD_NEWS:
+            return [
+                stage.value, '--news_json',
+                str(self.news_json_path), '--cover_audio_file',
+                str(self.cover_audio_file_path), '--ending_audio_file',
+                str(self.ending_audio_file_path), '--date', self.date, '--video_file',
+                str(self.video_file_path), '--cover_file',
+                str(self.cover_file_path), '--description_file',
+                str(self.description_file_path)
+            ]
+        if stage == EditionStage.UPLOAD_TO_BILIBILI:
+            return [
+                stage.value, '--date', self.date, '--video_file',
+                str(self.video_file_path), '--cover_file',
+                str(self.cover_file_path), '--description_file',
+                str(self.description_file_path)
+            ] + (['--edition_time', self.edition_time] if self.edition_time else [])
+        raise ValueError('Unknown edition stage {}'.format(stage))
@@ -0,0 +1,114 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import math
+from dataclasses import dataclass
+from typing import List
+
+# ref: http://www.mp3-tech.org/programmer/frame_header.html
+# Only layer III, as produced by edge-tts, is supported
+_MPEG1 = 3
+_MPEG2 = 2
+_MPEG25 = 0
+_LAYER3 = 1
+_BITRATES_KBPS = {
+    _MPEG1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    _MPEG2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    _MPEG1: [44100, 48000, 32000],
+    _MPEG2: [22050, 24000, 16000],
+    _MPEG25: [11025, 12000, 8000],
+}
+_ID3V2_HEADER_SIZE = 10
+
+
+@dataclass
+class Mp3Frame():
+    offset: int
+    length: int
+    samples: int
+    sample_rate: int
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+
+def _parse_frame(data: bytes, offset: int) -> Mp3Frame:
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        raise ValueError('No mp3 frame sync at offset {}'.format(offset))
+    version = (data[offset + 1] >> 3) & 0x03
+    layer = (data[offset + 1] >> 1) & 0x03
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x03
+    padding = (data[offset + 2] >> 1) & 0x01
+    if layer != _LAYER3 or version == 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        raise ValueError('Unsupported mp3 frame header at offset {}'.format(offset))
+    bitrate = _BITRATES_KBPS[_MPEG1 if version == _MPEG1 else _MPEG2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if version == _MPEG1 else 576
+    length = samples // 8 * bitrate // sample_rate + padding
+    return Mp3Frame(offset=offset, length=length, samples=samples, sample_rate=sample_rate)
+
+
+def _skip_id3v2(data: bytes) -> int:
+    if data[:3] != b'ID3' or len(data) < _ID3V2_HEADER_SIZE:
+        return 0
+    # The tag size is a 28 bits synchsafe integer
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    return _ID3V2_HEADER_SIZE + size
+
+
+def parse_mp3_frames(data: bytes) -> List[Mp3Frame]:
+    frames = []
+    offset = _skip_id3v2(data)
+    while offset < len(data):
+        # Stop at trailing tags or garbage after the last frame
+        try:
+            frame = _parse_frame(data, offset)
+        except ValueError:
+            break
+        frames.append(frame)
+        offset += frame.length
+    return frames
+
+
+def get_mp3_duration(data: bytes) -> float:
+    return sum(frame.duration for frame in parse_mp3_frames(data))
+
+
+def get_silent_mp3(reference_data: bytes, secs: float) -> bytes:
+    """Returns silent frames with the same format as the reference mp3.
+
+    A frame with zero side info and main data decodes to silence, and does not use the bit
+    reservoir, so it can be placed between any two frames.
+    """
+    reference_frame = parse_mp3_frames(reference_data)[0]
+    header = bytearray(reference_data[reference_frame.offset:reference_frame.offset + 4])
+    # Clear the padding bit so that all silent frames have the same length
+    header[2] &= 0xFD
+    # Protection bit 0 means a crc follows the header, which silent frames cannot provide
+    header[1] |= 0x01
+    frame = _parse_frame(bytes(header), 0)
+    frame_num = math.ceil(secs / frame.duration)
+    return (bytes(header) + bytes(frame.length - len(header))) * frame_num
+
+
+def concat_mp3_with_gaps(segments: List[bytes], gap_secs: float) -> bytes:
+    """Concatenates mp3 segments of the same format frame by frame, without re-encoding."""
+    # Parse each segment once, and skip those without frames
+    segments_frames = [(segment, frames)
+                       for segment, frames in zip(segments, map(parse_mp3_frames, segments))
+                       if frames]
+    if not segments_frames:
+        return b''
+    frames_data = [
+        segment[frames[0].offset:frames[-1].offset + frames[-1].length]
+        for segment, frames in segments_frames
+    ]
+    # The first frame is enough of a reference, rather than parsing the whole segment again
+    first_frame = segments_frames[0][1][0]
+    silence = get_silent_mp3(frames_data[0][:first_frame.length], gap_secs) if gap_secs > 0 else b''
+    return silence.join(frames_data)
@@ -29,5 +29,6 @@ def read_news_json(news_json_path: Path) -> List[News]:
                 comment_count=news.get('comment_count', 0),
                 image_path=news.get('image_path', ''),
                 brief_content=news.get('brief_content', ''),
-                audio_path=news.get('audio_path', '')))
+                audio_path=news.get('audio_path', ''),
+                audio_duration=news.get('audio_duration', 0.0)))
     return news_list
@@ -0,0 +1,169 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import contextvars
+import dataclasses
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from requests.exceptions import RequestException
+
+from class_news import News
+from util_dedup import NearDuplicateNewsFilter
+from util_request import request_deadline, request_get
+
+
+class NewsSourcePlugin(ABC):
+    """A news source, which generates ranked candidates and fetches their contents."""
+
+    name = ''
+
+    @abstractmethod
+    def get_candidates(self) -> List[News]:
+        """Returns the candidates without content in popularity desc."""
+
+    @abstractmethod
+    def fetch_content(self, news: News) -> Optional[News]:
+        """Returns the news with content, or None if it cannot be used."""
+
+    def get_popularity(self, news: News) -> float:
+        return news.comment_count
+
+
+@dataclasses.dataclass
+class _SourceResult():
+    plugin: NewsSourcePlugin
+    news_list: List[News] = dataclasses.field(default_factory=list)
+    popularities: Dict[str, float] = dataclasses.field(default_factory=dict)
+    max_popularity: float = 0.0
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def get_news_list(self) -> List[News]:
+        with self.lock:
+            return list(self.news_list)
+
+
+def _fetch_from_source(source_result: _SourceResult, news_num: int, deadline: float,
+                       dedup_threshold: float, is_enough: Optional[Callable[[List[News]], bool]]):
+    # Requests fail at the deadline, including those for the candidates, so that a late source
+    # ends soon rather than keeping the interpreter waiting for its thread at exit
+    with request_deadline(deadline - time.monotonic()):
+        _fetch_from_source_within_deadline(source_result, news_num, deadline, dedup_threshold,
+                                           is_enough)
+
+
+def _fetch_from_source_within_deadline(source_result: _SourceResult, news_num: int,
+                                       deadline: float, dedup_threshold: float,
+                                       is_enough: Optional[Callable[[List[News]], bool]]):
+    plugin = source_result.plugin
+    candidates = plugin.get_candidates()
+    source_result.popularities = {news.url: plugin.get_popularity(news) for news in candidates}
+    source_result.max_popularity = max(source_result.popularities.values(), default=0.0)
+    news_filter = NearDuplicateNewsFilter(threshold=dedup_threshold, with_content=True)
+    for news in candidates:
+        if time.monotonic() > deadline:
+            logging.warning('Source {} ran out of its time budget with {} news'.format(
+                plugin.name, len(source_result.news_list)))
+            break
+        news_with_content = plugin.fetch_content(news)
+        if news_with_content is None or news_filter.is_duplicate(news_with_content):
+            continue
+        # Publish every news right away, so that a timed out source still contributes
+        with source_result.lock:
+            source_result.news_list.append(news_with_content)
+        logging.info('Got the content of the news from {}: {} [{}]'.format(
+            plugin.name, news.title, len(source_result.news_list)))
+        if len(source_result.news_list) >= news_num or (
+                is_enough and is_enough(source_result.get_news_list())):
+            break
+    news_filter.log_clusters()
+
+
+def aggregate_news(plugins: List[NewsSourcePlugin],
+                   news_num: int,
+                   time_budget_secs: float,
+                   dedup_threshold: float,
+                   is_enough: Optional[Callable[[List[News]], bool]] = None) -> List[News]:
+    """Fetches all sources concurrently within the time budget and merges them into one ranking.
+
+    The popularity of each news is normalized by the max one of its source, so that sources of
+    different scales can be ranked together. Besides news_num, is_enough may stop a source from
+    pulling more candidates, and the ranking from taking more news.
+    """
+    source_results = [_SourceResult(plugin) for plugin in plugins]
+    deadline = time.monotonic() + time_budget_secs
+    executor = ThreadPoolExecutor(max_workers=max(len(plugins), 1))
+    # Copy the context for each source, so that an outer request deadline still applies
+    futures = {
+        executor.submit(contextvars.copy_context().run, _fetch_from_source, source_result,
+                        news_num, deadline, dedup_threshold, is_enough): source_result
+        for source_result in source_results
+    }
+    _, not_done_futures = wait(futures, timeout=time_budget_secs)
+    # Never wait for the late sources, their threads stop at the next deadline check
+    executor.shutdown(wait=False)
+    for future, source_result in futures.items():
+        if future in not_done_futures:
+            logging.warning('Source {} timed out, use its {} fetched news'.format(
+                source_result.plugin.name, len(source_result.get_news_list())))
+        elif future.exception() is not None:
+            logging.error('Source {} failed, use its {} fetched news: {}'.format(
+                source_result.plugin.name, len(source_result.get_news_list()),
+                future.exception()))
+
+    scored_news_list = []
+    for source_result in source_results:
+        for news in source_result.get_news_list():
+            popularity = source_result.popularities.get(news.url, 0.0)
+            score = popularity / source_result.max_popularity if source_result.max_popularity else 0
+            scored_news_list.append((score, news))
+    scored_news_list.sort(key=lambda scored_news: scored_news[0], reverse=True)
+
+    # The same story may come from several sources, keep the one ranked higher
+    news_filter = NearDuplicateNewsFilter(threshold=dedup_threshold, with_content=True)
+    news_list: List[News] = []
+    for _, news in scored_news_list:
+        if news_filter.is_duplicate(news):
+            continue
+        news_list.append(news)
+        if len(news_list) >= news_num or (is_enough and is_enough(news_list)):
+            break
+    news_filter.log_clusters()
+    if not news_list:
+        raise ConnectionError(
+            'No news is aggregated, all the {} sources failed or timed out'.format(len(plugins)))
+    logging.info('Aggregated {} news from {} sources'.format(len(news_list), len(plugins)))
+    return news_list
+
+
+def fetch_news_images(news_list_without_image: List[News], image_dir_path: Path) -> List[News]:
+    news_list: List[News] = []
+    for index, news in enumerate(news_list_without_image):
+        if not news.image_path:
+            logging.warning(
+                'There is no cover image for the news {}, skip download its image.'.format(
+                    news.title))
+            news_list.append(news)
+            continue
+        try:
+            raw_news_image_response = request_get(url=news.image_path)
+        except RequestException as exception:
+            # The slide of a news without image is still fine, do not fail the whole edition
+            logging.error('Failed to download the image of the news {}, skip it: {}'.format(
+                news.title, exception))
+            news_list.append(dataclasses.replace(news, image_path=''))
+            continue
+        image_extension = raw_news_image_response.headers.get('content-type',
+                                                              '').split('/')[-1] or 'webp'
+        image_path = image_dir_path / f'{str(index).zfill(2)}.{image_extension}'
+        image_path.write_bytes(raw_news_image_response.content)
+        news_with_image = dataclasses.replace(news)
+        news_with_image.image_path = str(image_path)
+        news_list.append(news_with_image)
+        logging.info('Downloaded the image of the news: {} [{}/{}] to {}'.format(
+            news.title, index + 1, len(news_list_without_image), str(image_path)))
+    return news_list
@@ -0,0 +1,135 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import dataclasses
+import hashlib
+import sqlite3
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List
+
+from class_news import News
+from util_news import write_news_json
+
+_SQLITE_TYPES = {
+    str: 'TEXT',
+    int: 'INTEGER',
+    float: 'REAL',
+}
+_NEWS_FIELDS = [field.name for field in dataclasses.fields(News)]
+
+
+class NewsStatus(Enum):
+    FETCHED = 'fetched'
+    SUMMARIZED = 'summarized'
+    READ = 'read'
+    DROPPED = 'dropped'
+
+
+def _get_content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class NewsStore():
+    """An embedded sqlite store of the news of all editions, keyed by (date, url).
+
+    The date is the edition's date string as in data/{YYYYMMDD}.
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(db_path))
+        self.connection.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self):
+        news_columns = ', '.join([
+            '{} {}'.format(field.name, _SQLITE_TYPES[field.type])
+            for field in dataclasses.fields(News)
+        ])
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS news (
+                    date TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    updated_timestamp REAL NOT NULL,
+                    {},
+                    PRIMARY KEY (date, url)
+                )'''.format(news_columns))
+            # Columns of news fields added after the table was created
+            existing_columns = {
+                row['name'] for row in self.connection.execute('PRAGMA table_info(news)')
+            }
+            for field in dataclasses.fields(News):
+                if field.name not in existing_columns:
+                    self.connection.execute('ALTER TABLE news ADD COLUMN {} {} DEFAULT {}'.format(
+                        field.name, _SQLITE_TYPES[field.type], repr(field.default)))
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS news_date_position ON news (date, position)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS news_url ON news (url)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS news_content_hash ON news (content_hash)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS news_status ON news (status)')
+
+    def upsert_news_list(self, date: str, news_list: List[News], status: NewsStatus):
+        """Inserts or updates the given rows only, keeping the positions of existing rows."""
+        columns = ['date', 'position', 'status', 'content_hash', 'updated_timestamp'
+                  ] + _NEWS_FIELDS
+        updated_columns = [
+            column for column in columns if column not in ('date', 'position', 'url')
+        ]
+        sql = 'INSERT INTO news ({}) VALUES ({}) ON CONFLICT (date, url) DO UPDATE SET {}'.format(
+            ', '.join(columns), ', '.join(['?'] * len(columns)),
+            ', '.join(['{0} = excluded.{0}'.format(column) for column in updated_columns]))
+        with self.connection:
+            next_position = self.connection.execute(
+                'SELECT COALESCE(MAX(position) + 1, 0) FROM news WHERE date = ?',
+                (date,)).fetchone()[0]
+            now = time.time()
+            for index, news in enumerate(news_list):
+                news_dict = news.as_dict()
+                self.connection.execute(sql, [
+                    date, next_position + index, status.value,
+                    _get_content_hash(news.content), now
+                ] + [news_dict[field] for field in _NEWS_FIELDS])
+
+    def delete_news_list(self, date: str):
+        with self.connection:
+            self.connection.execute('DELETE FROM news WHERE date = ?', (date,))
+
+    def mark_dropped(self, date: str, news_list: List[News]):
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE news SET status = ?, updated_timestamp = ? WHERE date = ? AND url = ?',
+                [(NewsStatus.DROPPED.value, time.time(), date, news.url) for news in news_list])
+
+    def read_news_list(self, date: str) -> List[News]:
+        rows = self.connection.execute(
+            'SELECT * FROM news WHERE date = ? AND status != ? ORDER BY position',
+            (date, NewsStatus.DROPPED.value))
+        return [News(**{field: row[field] for field in _NEWS_FIELDS}) for row in rows]
+
+    def find_dates_by_url(self, url: str, since_date: str = '') -> List[str]:
+        rows = self.connection.execute(
+            'SELECT DISTINCT date FROM news WHERE url = ? AND date >= ? AND status != ? '
+            'ORDER BY date', (url, since_date, NewsStatus.DROPPED.value))
+        return [row['date'] for row in rows]
+
+    def find_dates_by_content(self, content: str, since_date: str = '') -> List[str]:
+        rows = self.connection.execute(
+            'SELECT DISTINCT date FROM news WHERE content_hash = ? AND date >= ? AND status != ? '
+            'ORDER BY date', (_get_content_hash(content), since_date, NewsStatus.DROPPED.value))
+        return [row['date'] for row in rows]
+
+    def count_by_status(self, date: str) -> Dict[str, int]:
+        rows = self.connection.execute(
+            'SELECT status, COUNT(*) AS count FROM news WHERE date = ? GROUP BY status', (date,))
+        return {row['status']: row['count'] for row in rows}
+
+    def export_news_json(self, date: str, news_json_path: Path):
+        write_news_json(self.read_news_list(date), news_json_path)
+
+    def close(self):
+        self.connection.close()
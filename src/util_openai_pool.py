@@ -0,0 +1,149 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+import openai
+
+_DEFAULT_RPM = 3
+_RATE_WINDOW_SECS = 60
+_MEMBER_COOLDOWN_SECS = 30
+_MEMBER_MAX_COOLDOWN_SECS = 600
+# Errors caused by the request itself say nothing about the health of the key
+_REQUEST_ERRORS = (openai.error.InvalidRequestError,)
+# Errors which will not recover soon for the key
+_KEY_ERRORS = (openai.error.AuthenticationError, openai.error.PermissionError)
+
+
+class _PoolMember():
+
+    def __init__(self, name: str, api_key: str, api_base: Optional[str], rpm: int):
+        self.name = name
+        self.api_key = api_key
+        self.api_base = api_base
+        self.rpm = rpm
+        self.request_timestamps: Deque[float] = deque()
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.request_count = 0
+        self.failure_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def get_wait_secs(self, now: float) -> float:
+        """Returns the secs to wait until the rate limit of the member allows another request."""
+        while self.request_timestamps and self.request_timestamps[0] <= now - _RATE_WINDOW_SECS:
+            self.request_timestamps.popleft()
+        if len(self.request_timestamps) < self.rpm:
+            return 0.0
+        return self.request_timestamps[0] + _RATE_WINDOW_SECS - now
+
+    def get_load(self) -> float:
+        return (len(self.request_timestamps) + self.in_flight) / self.rpm
+
+
+class OpenAIPool():
+    """A pool of openai keys and endpoints, each with its own rate limit.
+
+    Requests go to the least loaded healthy member, and members failing in a row are cooled down
+    with exponential backoff. The proxy is still global, as openai 0.27 only supports
+    openai.proxy, so use an api_base to reach a member through another endpoint.
+    """
+
+    def __init__(self, members: List[_PoolMember]):
+        if not members:
+            raise ValueError('The openai pool needs at least one member')
+        self.members = members
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, openai_api_key: str, openai_pool_config: Optional[List[dict]]):
+        """Builds the pool from the openai_pool list of config.json, or from the single key."""
+        # Members left with an empty key, as in example.config.json, are ignored
+        member_configs = [
+            member_config for member_config in openai_pool_config or []
+            if member_config.get('api_key')
+        ] or [{
+            'api_key': openai_api_key
+        }]
+        return cls([
+            _PoolMember(
+                name=member_config.get('name') or 'key-{}'.format(index),
+                api_key=member_config['api_key'],
+                api_base=member_config.get('api_base'),
+                rpm=member_config.get('rpm', _DEFAULT_RPM))
+            for index, member_config in enumerate(member_configs)
+        ])
+
+    def _acquire(self) -> _PoolMember:
+        with self.condition:
+            while True:
+                now = time.time()
+                healthy_members = [
+                    member for member in self.members if member.cooldown_until <= now
+                ]
+                if not healthy_members:
+                    wait_secs = min(member.cooldown_until for member in self.members) - now
+                    logging.warning(
+                        'All openai pool members are cooling down, wait {:.1f} secs'.format(
+                            wait_secs))
+                    self.condition.wait(wait_secs)
+                    continue
+                member = min(
+                    healthy_members,
+                    key=lambda member: (member.get_wait_secs(now), member.get_load()))
+                wait_secs = member.get_wait_secs(now)
+                if wait_secs > 0:
+                    self.condition.wait(wait_secs)
+                    continue
+                member.request_timestamps.append(now)
+                member.in_flight += 1
+                member.request_count += 1
+                return member
+
+    def _release(self, member: _PoolMember, exception: Optional[Exception]):
+        with self.condition:
+            member.in_flight -= 1
+            if exception is None or isinstance(exception, _REQUEST_ERRORS):
+                member.consecutive_failures = 0
+            else:
+                member.consecutive_failures += 1
+                member.failure_count += 1
+                cooldown_secs = _MEMBER_MAX_COOLDOWN_SECS if isinstance(
+                    exception, _KEY_ERRORS) else min(
+                        _MEMBER_COOLDOWN_SECS * 2**(member.consecutive_failures - 1),
+                        _MEMBER_MAX_COOLDOWN_SECS)
+                member.cooldown_until = time.time() + cooldown_secs
+                logging.warning('Cool down openai pool member {} for {} secs: {}'.format(
+                    member.name, cooldown_secs, exception))
+            self.condition.notify_all()
+
+    def create_chat_completion(self, **kwargs):
+        member = self._acquire()
+        try:
+            response = openai.ChatCompletion.create(
+                api_key=member.api_key, api_base=member.api_base, **kwargs)
+        except Exception as exception:
+            self._release(member, exception)
+            raise
+        self._release(member, None)
+        # Streamed responses do not report usage
+        usage = response.get('usage') if isinstance(response, dict) else None
+        if usage:
+            with self.condition:
+                member.prompt_tokens += usage.get('prompt_tokens', 0)
+                member.completion_tokens += usage.get('completion_tokens', 0)
+        return response
+
+    def log_usage(self):
+        with self.condition:
+            for member in self.members:
+                logging.info(
+                    'Openai pool member {}: {} requests, {} failures, {} prompt tokens, '
+                    '{} completion tokens'.format(member.name, member.request_count,
+                                                  member.failure_count, member.prompt_tokens,
+                                                  member.completion_tokens))
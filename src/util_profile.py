@@ -0,0 +1,213 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import cProfile
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Counter as CounterType, List, Optional
+
+import click
+
+_SAMPLE_INTERVAL_SECS = 0.005
+_TOP_ALLOCATIONS_NUM = 30
+_FALLBACK_PROFILE_DIR = 'data/profiles'
+# The context meta is shared with the subcommands, so namespace its keys
+_META_KEY_PREFIX = 'util_profile.'
+_PROFILE_META_KEY = _META_KEY_PREFIX + 'profile'
+_PROFILE_DIR_META_KEY = _META_KEY_PREFIX + 'profile_dir'
+_PROFILE_MEMORY_META_KEY = _META_KEY_PREFIX + 'profile_memory'
+_PENDING_META_KEY = _META_KEY_PREFIX + 'pending'
+_PROFILER_META_KEY = _META_KEY_PREFIX + 'profiler'
+# Params of subcommands locating the edition's data dir, with the levels to go up
+_EDITION_PATH_PARAMS = [
+    ('news_json', 1),
+    ('video_file', 1),
+    ('description_file', 1),
+    ('image_dir', 1),
+    ('audio_dir', 1),
+    ('cover_audio_file', 2),
+    ('output_dir', 0),
+]
+
+
+def _get_frame_name(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, Path(code.co_filename).name, code.co_firstlineno)
+
+
+class _StackSampler():
+    """Samples the stacks of all threads, folded in the collapsed format of flamegraph.pl."""
+
+    def __init__(self, interval_secs: float):
+        self.interval_secs = interval_secs
+        self.stack_counts: CounterType[str] = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        sampler_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval_secs):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for thread_id, frame in frames.items():
+                if thread_id == sampler_thread_id:
+                    continue
+                frame_names = []
+                while frame is not None:
+                    frame_names.append(_get_frame_name(frame))
+                    frame = frame.f_back
+                frame_names.append(thread_names.get(thread_id, str(thread_id)))
+                self.stack_counts[';'.join(reversed(frame_names))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, path: Path):
+        path.write_text(
+            ''.join(['{} {}\n'.format(stack, count) for stack, count in self.stack_counts.items()]),
+            encoding='utf-8')
+
+
+class Profiler():
+    """Profiles a run with cProfile, a stack sampler and optionally tracemalloc.
+
+    Writes {name}.pstats for pstats or snakeviz, {name}.collapsed for flamegraph.pl or speedscope,
+    and with trace_memory {name}.memory.txt with the peak and the top allocations. cProfile only
+    sees the thread which starts it, the sampler sees all threads. tracemalloc slows down
+    allocation-heavy code by several times, so its run is not for timing.
+    """
+
+    def __init__(self, output_dir_path: Path, name: str, trace_memory: bool = False):
+        self.output_dir_path = output_dir_path
+        self.name = name
+        self.trace_memory = trace_memory
+        self.profile = cProfile.Profile()
+        self.sampler = _StackSampler(_SAMPLE_INTERVAL_SECS)
+        self.start_time = 0.0
+
+    def start(self):
+        # Never log here, the first log before setup_logging would install the default handler
+        self.start_time = time.time()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.sampler.start()
+        self.profile.enable()
+
+    def _write_memory(self, path: Path) -> float:
+        """Writes the peak and the top allocations, then returns the peak in MB."""
+        _, peak_memory = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        peak_memory_mb = peak_memory / 1024 / 1024
+        memory_lines = ['Peak traced memory: {:.1f} MB'.format(peak_memory_mb), '']
+        memory_lines += [
+            str(stat) for stat in snapshot.statistics('lineno')[:_TOP_ALLOCATIONS_NUM]
+        ]
+        path.write_text('\n'.join(memory_lines) + '\n', encoding='utf-8')
+        return peak_memory_mb
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        elapsed_secs = time.time() - self.start_time
+
+        self.output_dir_path.mkdir(parents=True, exist_ok=True)
+        path_prefix = self.output_dir_path / self.name
+        self.profile.dump_stats(str(path_prefix) + '.pstats')
+        self.sampler.write(Path(str(path_prefix) + '.collapsed'))
+        logging.info('Profiled {} in {:.1f} secs to {}'.format(self.name, elapsed_secs,
+                                                              str(self.output_dir_path)))
+        if self.trace_memory:
+            peak_memory_mb = self._write_memory(Path(str(path_prefix) + '.memory.txt'))
+            logging.info('Peak traced memory of {}: {:.1f} MB'.format(self.name, peak_memory_mb))
+
+
+def _get_edition_dir_path(params: dict) -> Optional[Path]:
+    for param_name, levels_up in _EDITION_PATH_PARAMS:
+        if params.get(param_name):
+            path = Path(params[param_name])
+            for _ in range(levels_up):
+                path = path.parent
+            return path
+    if params.get('date'):
+        return Path('data') / params['date']
+    return None
+
+
+def _store_in_meta(ctx: click.Context, param: click.Parameter, value):
+    ctx.meta[_META_KEY_PREFIX + param.name] = value
+
+
+class ProfiledGroup(click.Group):
+    """A click group whose --profile option profiles the invoked subcommand.
+
+    The results go to the profiles dir under the edition's data dir, located by the path params
+    of the subcommand, unless --profile_dir is given. The options are kept in the context meta
+    rather than passed to the group callback.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.params.append(
+            click.Option(['--profile'],
+                         is_flag=True,
+                         expose_value=False,
+                         callback=_store_in_meta,
+                         help='Profile the subcommand with cProfile, which only covers the main '
+                         'thread, and a sampler of all threads'))
+        self.params.append(
+            click.Option(['--profile_memory'],
+                         is_flag=True,
+                         expose_value=False,
+                         callback=_store_in_meta,
+                         help='With --profile, also trace allocations with tracemalloc, which '
+                         'slows down the run by several times'))
+        self.params.append(
+            click.Option(['--profile_dir'],
+                         type=click.Path(file_okay=False),
+                         expose_value=False,
+                         callback=_store_in_meta,
+                         help='Where to write the profiles, under the edition dir by default'))
+
+    def _create_profiler(self, ctx: click.Context, cmd_name: str, cmd: click.Command,
+                         cmd_args: List[str]) -> Profiler:
+        profile_dir = ctx.meta.get(_PROFILE_DIR_META_KEY)
+        output_dir_path = Path(profile_dir) if profile_dir else None
+        if output_dir_path is None:
+            # Parse the subcommand args without validation or side effects, only to find its paths
+            with cmd.make_context(cmd_name, list(cmd_args), parent=ctx,
+                                  resilient_parsing=True) as cmd_ctx:
+                edition_dir_path = _get_edition_dir_path(cmd_ctx.params)
+            output_dir_path = (edition_dir_path / 'profiles'
+                               if edition_dir_path else Path(_FALLBACK_PROFILE_DIR))
+        return Profiler(output_dir_path,
+                        '{}_{}'.format(cmd_name, datetime.now().strftime('%Y%m%d%H%M%S')),
+                        trace_memory=bool(ctx.meta.get(_PROFILE_MEMORY_META_KEY)))
+
+    def resolve_command(self, ctx: click.Context, args: List[str]):
+        cmd_name, cmd, cmd_args = super().resolve_command(ctx, args)
+        # Invoking the group resolves the subcommand right before running it, so start here
+        if ctx.meta.pop(_PENDING_META_KEY, False) and cmd is not None:
+            profiler = self._create_profiler(ctx, cmd_name, cmd, cmd_args)
+            profiler.start()
+            ctx.meta[_PROFILER_META_KEY] = profiler
+        return cmd_name, cmd, cmd_args
+
+    def invoke(self, ctx: click.Context):
+        ctx.meta[_PENDING_META_KEY] = bool(ctx.meta.get(_PROFILE_META_KEY))
+        try:
+            return super().invoke(ctx)
+        finally:
+            ctx.meta.pop(_PENDING_META_KEY, None)
+            profiler = ctx.meta.pop(_PROFILER_META_KEY, None)
+            if profiler is not None:
+                profiler.stop()
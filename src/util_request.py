@@ -1,33 +1,280 @@
 # Copyright @2023. All rights reserved.
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import contextvars
 import logging
-from typing import Optional
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Union
+from urllib.parse import urlparse
 
 import requests
-from retry.api import retry_call
 
 _DEFAULT_HEADERS = {
     "User-Agent":
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"  # pylint: disable=line-too-long
 }
+# requests.Session is not thread-safe, so each thread keeps its own, whose connections are pooled
+# and kept alive across the requests of the thread
+_THREAD_LOCAL = threading.local()
+
+# Hedging: duplicate an idempotent request which is slower than most recent ones of its host
+_LATENCY_WINDOW_SIZE = 100
+_HEDGE_MIN_LATENCY_SAMPLES = 20
+_HEDGE_LATENCY_PERCENTILE = 95
+_HEDGE_MAX_WORKERS = 16
+_HEDGE_METHODS = ('GET',)
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=_HEDGE_MAX_WORKERS)
+
+# Circuit breaker: fail fast on a host after consecutive failures, then let one trial through
+_CIRCUIT_FAILURE_THRESHOLD = 5
+_CIRCUIT_OPEN_SECS = 30
+
+# Retry budget: every request earns a fraction of a retry, so that retries stay a small share of
+# the traffic when a dependency is down
+_RETRY_BUDGET_RATIO = 0.2
+_RETRY_BUDGET_MAX_TOKENS = 20
+_RETRY_JITTER = 0.5
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+class DeadlineExceededError(requests.exceptions.Timeout):
+    pass
+
+
+class _HostState():
+
+    def __init__(self, host: str):
+        self.host = host
+        self.lock = threading.Lock()
+        self.latencies: Deque[float] = deque(maxlen=_LATENCY_WINDOW_SIZE)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.is_trial_running = False
+
+    def get_hedge_delay(self) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies) < _HEDGE_MIN_LATENCY_SAMPLES:
+                return None
+            sorted_latencies = sorted(self.latencies)
+        return sorted_latencies[min(
+            len(sorted_latencies) * _HEDGE_LATENCY_PERCENTILE // 100,
+            len(sorted_latencies) - 1)]
+
+    def before_request(self) -> bool:
+        """Raises if the circuit is open, or returns whether the request is the half open trial."""
+        with self.lock:
+            if self.consecutive_failures < _CIRCUIT_FAILURE_THRESHOLD:
+                return False
+            if time.time() < self.open_until or self.is_trial_running:
+                raise CircuitOpenError('Circuit of {} is open after {} failures'.format(
+                    self.host, self.consecutive_failures))
+            # Half open, let a single trial request through
+            self.is_trial_running = True
+            return True
+
+    def end_trial(self):
+        with self.lock:
+            self.is_trial_running = False
+
+    def on_success(self, latency: float):
+        with self.lock:
+            self.latencies.append(latency)
+            if self.consecutive_failures >= _CIRCUIT_FAILURE_THRESHOLD:
+                logging.info('Circuit of {} is closed'.format(self.host))
+            self.consecutive_failures = 0
+            self.is_trial_running = False
+
+    def on_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.is_trial_running = False
+            if self.consecutive_failures >= _CIRCUIT_FAILURE_THRESHOLD:
+                self.open_until = time.time() + _CIRCUIT_OPEN_SECS
+                logging.warning('Circuit of {} is open for {} secs after {} failures'.format(
+                    self.host, _CIRCUIT_OPEN_SECS, self.consecutive_failures))
+
+
+class _RetryBudget():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = float(_RETRY_BUDGET_MAX_TOKENS)
+
+    def on_request(self):
+        with self.lock:
+            self.tokens = min(self.tokens + _RETRY_BUDGET_RATIO, _RETRY_BUDGET_MAX_TOKENS)
+
+    def try_withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_HOST_STATES: Dict[str, _HostState] = {}
+_HOST_STATES_LOCK = threading.Lock()
+_RETRY_BUDGET = _RetryBudget()
+# A context variable, so that concurrent stages in one process do not share deadlines. Threads
+# start with an empty context, run them in contextvars.copy_context() to inherit the deadline.
+_DEADLINE_TIMESTAMP: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    'request_deadline_timestamp', default=None)
+
+
+@contextmanager
+def request_deadline(secs: Optional[float]) -> Iterator[None]:
+    """Fails all requests within the context, including retries, once the deadline passes.
+
+    A nested context may shorten the deadline of the outer one, but never extends it.
+    """
+    previous_deadline_timestamp = _DEADLINE_TIMESTAMP.get()
+    if secs is None:
+        yield
+        return
+    deadline_timestamp = time.time() + secs
+    if previous_deadline_timestamp is not None:
+        deadline_timestamp = min(deadline_timestamp, previous_deadline_timestamp)
+    token = _DEADLINE_TIMESTAMP.set(deadline_timestamp)
+    try:
+        yield
+    finally:
+        _DEADLINE_TIMESTAMP.reset(token)
+
+
+def _get_remaining_secs() -> Optional[float]:
+    deadline_timestamp = _DEADLINE_TIMESTAMP.get()
+    if deadline_timestamp is None:
+        return None
+    return deadline_timestamp - time.time()
+
+
+def _request_in_session(method: str, url: str, **kargs) -> requests.Response:
+    if not hasattr(_THREAD_LOCAL, 'session'):
+        _THREAD_LOCAL.session = requests.Session()
+    return _THREAD_LOCAL.session.request(method, url, **kargs)
+
+
+def _get_host_state(url: str) -> _HostState:
+    host = urlparse(url).netloc
+    with _HOST_STATES_LOCK:
+        if host not in _HOST_STATES:
+            _HOST_STATES[host] = _HostState(host)
+        return _HOST_STATES[host]
+
+
+def _send_hedged_request(method: str, url: str, hedge_delay: float,
+                         **kargs) -> requests.Response:
+    sent_event = threading.Event()
+
+    def send_original() -> requests.Response:
+        sent_event.set()
+        return _request_in_session(method, url, **kargs)
+
+    original_future = _HEDGE_EXECUTOR.submit(send_original)
+    # Time the hedge delay from when the request is sent, not from when it waits in the pool. If
+    # the pool is too busy to send it in time, hedging would not help, so send it inline.
+    if not sent_event.wait(min(hedge_delay, kargs['timeout'])) and original_future.cancel():
+        logging.debug('Hedge pool is busy, sending the request to {} inline'.format(url))
+        return _request_in_session(method, url, **kargs)
+    futures = {original_future}
+    done_futures, _ = wait(futures, timeout=hedge_delay)
+    if not done_futures:
+        logging.debug('Hedging the request to {} after {:.2f} secs'.format(url, hedge_delay))
+        futures.add(_HEDGE_EXECUTOR.submit(_request_in_session, method, url, **kargs))
+    # Return the first success, or raise the last failure
+    pending_futures = futures
+    exception: Optional[BaseException] = None
+    while pending_futures:
+        done_futures, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+        for future in done_futures:
+            if future.exception() is None:
+                return future.result()
+            exception = future.exception()
+    raise exception
+
+
+def _send_request_once(method: str, url: str, host_state: _HostState, circuit_breaker: bool,
+                       **kargs) -> requests.Response:
+    is_trial = host_state.before_request() if circuit_breaker else False
+    try:
+        remaining_secs = _get_remaining_secs()
+        is_timeout_clipped = False
+        if remaining_secs is not None:
+            if remaining_secs <= 0:
+                raise DeadlineExceededError('Deadline exceeded before requesting {}'.format(url))
+            if kargs.get('timeout') is None or remaining_secs < kargs['timeout']:
+                kargs['timeout'] = remaining_secs
+                is_timeout_clipped = True
+        hedge_delay = host_state.get_hedge_delay() if method in _HEDGE_METHODS else None
+        start_time = time.time()
+        try:
+            if hedge_delay is None:
+                response = _request_in_session(method, url, **kargs)
+            else:
+                response = _send_hedged_request(method, url, hedge_delay, **kargs)
+        except requests.exceptions.RequestException as exception:
+            # Running out of the caller's deadline says nothing about the health of the host
+            if is_timeout_clipped and isinstance(exception, requests.exceptions.Timeout):
+                raise DeadlineExceededError('Deadline exceeded when requesting {}: {}'.format(
+                    url, exception)) from exception
+            if circuit_breaker:
+                host_state.on_failure()
+            raise
+        # 5xx responses are returned to the caller as they are, neither failing nor closing the
+        # circuit, and their latencies are not those of served requests
+        if response.status_code < 500:
+            host_state.on_success(time.time() - start_time)
+        return response
+    finally:
+        # Whatever was raised, never leave the circuit half open for good
+        if is_trial:
+            host_state.end_trial()
 
 
 def _send_request(method: str, url: str, retry_times: int, delay: float, backoff: float,
-                  **kargs) -> requests.Response:
+                  circuit_breaker: bool, **kargs) -> requests.Response:
+    # Avoid formatting binary payloads (e.g. video chunks) into the log
+    logged_kargs = {
+        key: ('<{} bytes>'.format(len(value)) if isinstance(value, bytes) else value)
+        for key, value in kargs.items()
+    }
     logging.debug('Sending request: {}'.format(
         dict(
-            method=method, url=url, retry_times=retry_times, delay=delay, backoff=backoff,
-            **kargs)))
-    response = retry_call(
-        requests.request,
-        fargs=[method, url],
-        fkwargs=kargs,
-        exceptions=(requests.exceptions.RequestException, requests.exceptions.HTTPError),
-        tries=retry_times,
-        delay=delay,
-        backoff=backoff,
-    )
-    return response
+            method=method,
+            url=url,
+            retry_times=retry_times,
+            delay=delay,
+            backoff=backoff,
+            **logged_kargs)))
+    host_state = _get_host_state(url)
+    _RETRY_BUDGET.on_request()
+    retry_delay = delay
+    for try_index in range(retry_times):
+        try:
+            return _send_request_once(method, url, host_state, circuit_breaker, **kargs)
+        except (CircuitOpenError, DeadlineExceededError):
+            raise
+        except requests.exceptions.RequestException as exception:
+            if try_index == retry_times - 1:
+                raise
+            if not _RETRY_BUDGET.try_withdraw():
+                logging.warning('Retry budget exhausted, give up {}: {}'.format(url, exception))
+                raise
+            sleep_secs = retry_delay * random.uniform(1 - _RETRY_JITTER, 1 + _RETRY_JITTER)
+            remaining_secs = _get_remaining_secs()
+            if remaining_secs is not None and sleep_secs >= remaining_secs:
+                raise
+            logging.warning('{}, retrying {} in {:.1f} secs'.format(exception, url, sleep_secs))
+            time.sleep(sleep_secs)
+            retry_delay *= backoff
+    raise ValueError('Invalid retry times {}'.format(retry_times))
 
 
 def request_get(
@@ -38,6 +285,7 @@ def request_get(
         retry_times: int = 5,
         delay: float = 1,
         backoff: float = 2,
+        circuit_breaker: bool = True,
 ) -> requests.Response:
     return _send_request(
         method='GET',
@@ -45,6 +293,7 @@ def request_get(
         retry_times=retry_times,
         delay=delay,
         backoff=backoff,
+        circuit_breaker=circuit_breaker,
         params=params,
         headers={
             **_DEFAULT_HEADERS,
@@ -55,12 +304,14 @@ def request_get(
 
 def request_post(
         url: str,
-        data: Optional[dict] = None,
+        data: Optional[Union[dict, str, bytes]] = None,
+        params: Optional[dict] = None,
         extra_headers: Optional[dict] = None,
         timeout: float = 5,
         retry_times: int = 5,
         delay: float = 1,
         backoff: float = 2,
+        circuit_breaker: bool = True,
 ) -> requests.Response:
     return _send_request(
         method='POST',
@@ -68,7 +319,36 @@ def request_post(
         retry_times=retry_times,
         delay=delay,
         backoff=backoff,
+        circuit_breaker=circuit_breaker,
         data=data,
+        params=params,
+        headers={
+            **_DEFAULT_HEADERS,
+            **(extra_headers or {}),
+        },
+        timeout=timeout)
+
+
+def request_put(
+        url: str,
+        data: bytes,
+        params: Optional[dict] = None,
+        extra_headers: Optional[dict] = None,
+        timeout: float = 60,
+        retry_times: int = 5,
+        delay: float = 1,
+        backoff: float = 2,
+        circuit_breaker: bool = True,
+) -> requests.Response:
+    return _send_request(
+        method='PUT',
+        url=url,
+        retry_times=retry_times,
+        delay=delay,
+        backoff=backoff,
+        circuit_breaker=circuit_breaker,
+        data=data,
+        params=params,
         headers={
             **_DEFAULT_HEADERS,
             **(extra_headers or {}),
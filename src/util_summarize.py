@@ -1,9 +1,10 @@
 # Copyright @2023. All rights reserved.
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
 import dataclasses
+import json
 import logging
-from time import sleep
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
 
 import openai
 import requests
@@ -11,83 +12,285 @@ from retry.api import retry_call
 
 from class_news import News
 from util import count_chinese_chars
+from util_openai_pool import OpenAIPool
+from util_token import count_tokens, truncate_to_tokens
 
-# NOTE: chatgpt3.5 has a limit of 4096 tokens, and one Chinese character is about two tokens
 _OPENAI_MODEL = 'gpt-3.5-turbo'
+_OPENAI_CONTEXT_WINDOW_TOKENS = 4096
+# ref: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb  # pylint: disable=line-too-long
+_OPENAI_TOKENS_PER_MESSAGE = 4
+_OPENAI_TOKENS_PER_REPLY = 3
 _OPENAI_MAX_TOKENS = 300
 _OPENAI_TEMPERATUR = 1.0
 _OPENAI_PRESENCE_PENALTY = 1.0
 _OPENAI_FREQUENCY_PENALTY = 0.5
 _OPENAI_ASSISTANT_PROMPT = 'You are a helpful assistant.'
-_MAX_INPUT_CONTENT_CHINESE_CHARS = 1600
 _SUMMARIZE_QUESTION_FMT = '请为以下新闻写一篇100字以内、不含标题的中文摘要：\n\n《{title}》\n{content}'
+_BATCH_SUMMARIZE_QUESTION_FMT = (
+    '请为以下{news_num}篇新闻分别写一篇100字以内、不含标题的中文摘要。'
+    '请只输出一个JSON对象，键为新闻编号（如"1"），值为对应的摘要：\n\n{news_txt}')
+_BATCH_NEWS_FMT = '【{index}】《{title}》\n{content}'
+_BATCH_NEWS_SEPARATOR = '\n\n'
 
+_openai_pool: Optional[OpenAIPool] = None  # pylint: disable=invalid-name
+_openai_pool_config: Optional[tuple] = None  # pylint: disable=invalid-name
 
-def init_openai(openai_api_key: str, openai_proxy: Optional[str] = None):
+
+def init_openai(openai_api_key: str,
+                openai_proxy: Optional[str] = None,
+                openai_pool_config: Optional[List[dict]] = None):
+    global _openai_pool, _openai_pool_config  # pylint: disable=global-statement,invalid-name
     openai.api_key = openai_api_key
     if openai_proxy:
         openai.proxy = openai_proxy
+    # Keep the rate limits of the pool when stages run many times or concurrently in one process
+    if _openai_pool is None or _openai_pool_config != (openai_api_key, openai_pool_config):
+        _openai_pool = OpenAIPool.from_config(openai_api_key, openai_pool_config)
+        _openai_pool_config = (openai_api_key, openai_pool_config)
 
 
-def summarize_news_with_gpt(
-        news: News,
-        retry_times: int = 3,
-        delay: float = 25,
-) -> Optional[News]:
-    content = news.content
-    if count_chinese_chars(content) > _MAX_INPUT_CONTENT_CHINESE_CHARS:
+def log_openai_usage():
+    if _openai_pool:
+        _openai_pool.log_usage()
+
+
+def _count_prompt_tokens(question: str) -> int:
+    return count_tokens(_OPENAI_ASSISTANT_PROMPT, _OPENAI_MODEL) + count_tokens(
+        question, _OPENAI_MODEL) + _OPENAI_TOKENS_PER_MESSAGE * 2 + _OPENAI_TOKENS_PER_REPLY
+
+
+def _truncate_content(news: News) -> str:
+    """Truncates the content so that the single news prompt and its answer fit in the window."""
+    max_content_tokens = _OPENAI_CONTEXT_WINDOW_TOKENS - _OPENAI_MAX_TOKENS - _count_prompt_tokens(
+        _SUMMARIZE_QUESTION_FMT.format(title=news.title, content=''))
+    content = truncate_to_tokens(news.content, max_content_tokens, _OPENAI_MODEL)
+    if len(content) < len(news.content):
         logging.warning(
-            'The content to summarize is too long with {} chinese chars, while we have a limit of {}'.  # pylint: disable=line-too-long
-            format(count_chinese_chars(content), _MAX_INPUT_CONTENT_CHINESE_CHARS))
-        while count_chinese_chars(content) > _MAX_INPUT_CONTENT_CHINESE_CHARS:
-            content = content[:len(content) - 1]
-            punctuation_index = max(
-                content.rfind('。'),
-                content.rfind('！'),
-                content.rfind('？'),
-            )
-            if punctuation_index < -1:
-                logging.error('Cannot find any punctuation mark, skip!')
-            content = content[:(punctuation_index + 1)]
-    messages = [
-        {
-            'role': 'system',
-            'content': _OPENAI_ASSISTANT_PROMPT,
-        },
-        {
-            'role': 'user',
-            'content': _SUMMARIZE_QUESTION_FMT.format(
-                title=news.title,
-                content=content,
-            ),
-        },
-    ]
+            'The content to summarize is too long with {} tokens, truncated to {} chinese chars'.
+            format(count_tokens(news.content, _OPENAI_MODEL), count_chinese_chars(content)))
+    return content
+
+
+def _get_chat_completion_kwargs(question: str, max_tokens: int) -> dict:
+    return dict(
+        model=_OPENAI_MODEL,
+        messages=[
+            {
+                'role': 'system',
+                'content': _OPENAI_ASSISTANT_PROMPT,
+            },
+            {
+                'role': 'user',
+                'content': question,
+            },
+        ],
+        temperature=_OPENAI_TEMPERATUR,
+        n=1,
+        max_tokens=max_tokens,
+        presence_penalty=_OPENAI_PRESENCE_PENALTY,
+        frequency_penalty=_OPENAI_FREQUENCY_PENALTY,
+    )
+
+
+def _create_chat_completion(question: str, max_tokens: int, retry_times: int,
+                            delay: float) -> Optional[str]:
+    if _openai_pool is None:
+        raise ValueError('Call init_openai before requesting openai')
     response = retry_call(
-        openai.ChatCompletion.create,
+        _openai_pool.create_chat_completion,
         fargs=[],
-        fkwargs=dict(
-            model=_OPENAI_MODEL,
-            messages=messages,
-            temperature=_OPENAI_TEMPERATUR,
-            n=1,
-            max_tokens=_OPENAI_MAX_TOKENS,
-            presence_penalty=_OPENAI_PRESENCE_PENALTY,
-            frequency_penalty=_OPENAI_FREQUENCY_PENALTY,
-        ),
+        fkwargs=_get_chat_completion_kwargs(question, max_tokens),
         exceptions=(openai.OpenAIError, requests.exceptions.RequestException),
         tries=retry_times,
         delay=delay,
     )
 
-    # Actively sleep, because the openai api has a request limit of 3/min
-    sleep(delay)
-
     if len(response.choices) == 0:
+        return None
+    return response.choices[0]['message']['content']
+
+
+def _stream_chat_completion(question: str, max_tokens: int, retry_times: int,
+                            delay: float) -> Iterator[str]:
+    """Yields the answer piece by piece. Only establishing the stream is retried."""
+    if _openai_pool is None:
+        raise ValueError('Call init_openai before requesting openai')
+    chunks = retry_call(
+        _openai_pool.create_chat_completion,
+        fargs=[],
+        fkwargs=dict(stream=True, **_get_chat_completion_kwargs(question, max_tokens)),
+        exceptions=(openai.OpenAIError, requests.exceptions.RequestException),
+        tries=retry_times,
+        delay=delay,
+    )
+    for chunk in chunks:
+        if chunk.choices:
+            yield chunk.choices[0]['delta'].get('content', '')
+
+
+def summarize_news_with_gpt(
+        news: News,
+        retry_times: int = 3,
+        delay: float = 25,
+) -> Optional[News]:
+    content = _truncate_content(news)
+    brief_content = _create_chat_completion(
+        question=_SUMMARIZE_QUESTION_FMT.format(
+            title=news.title,
+            content=content,
+        ),
+        max_tokens=_OPENAI_MAX_TOKENS,
+        retry_times=retry_times,
+        delay=delay)
+    if brief_content is None:
         logging.error('No response from openai gpt, the news will be skipped: {}'.format(
             news.title))
         return None
     news_with_summary = dataclasses.replace(news)
-    news_with_summary.brief_content = response.choices[0]['message']['content']
+    news_with_summary.brief_content = brief_content
     logging.info('Summarized content for {} in {} chinese characters.'.format(
         news.title, count_chinese_chars(news_with_summary.brief_content)))
     return news_with_summary
+
+
+def stream_news_summary_with_gpt(
+        news: News,
+        retry_times: int = 3,
+        delay: float = 25,
+) -> Iterator[str]:
+    """Yields the summary of the news piece by piece, as the answer of openai gpt arrives."""
+    content = _truncate_content(news)
+    yield from _stream_chat_completion(
+        question=_SUMMARIZE_QUESTION_FMT.format(
+            title=news.title,
+            content=content,
+        ),
+        max_tokens=_OPENAI_MAX_TOKENS,
+        retry_times=retry_times,
+        delay=delay)
+
+
+def _get_batch_question(news_list: List[News], contents: List[str]) -> str:
+    return _BATCH_SUMMARIZE_QUESTION_FMT.format(
+        news_num=len(news_list),
+        news_txt=_BATCH_NEWS_SEPARATOR.join([
+            _BATCH_NEWS_FMT.format(index=index + 1, title=news.title, content=content)
+            for index, (news, content) in enumerate(zip(news_list, contents))
+        ]))
+
+
+def _count_batch_news_tokens(news: News, content: str, index: int) -> int:
+    return count_tokens(_BATCH_NEWS_FMT.format(index=index + 1, title=news.title, content=content),
+                        _OPENAI_MODEL) + count_tokens(_BATCH_NEWS_SEPARATOR, _OPENAI_MODEL)
+
+
+def _pack_batches(news_list: List[News], batch_size: int) -> List[List[News]]:
+    """Greedily packs news into batches whose prompt and answers fit in the context window.
+
+    Keeps a running total of the tokens, counting the question without the news once and each news
+    once, rather than counting the whole growing question for every news.
+    """
+    # With the widest news number a batch can have
+    question_tokens = _count_prompt_tokens(
+        _BATCH_SUMMARIZE_QUESTION_FMT.format(news_num=batch_size, news_txt=''))
+    batches: List[List[News]] = []
+    batch: List[News] = []
+    total_tokens = question_tokens
+    for news in news_list:
+        content = _truncate_content(news)
+        news_tokens = _count_batch_news_tokens(news, content, len(batch)) + _OPENAI_MAX_TOKENS
+        if batch and (len(batch) >= batch_size or
+                      total_tokens + news_tokens > _OPENAI_CONTEXT_WINDOW_TOKENS):
+            batches.append(batch)
+            batch, total_tokens = [], question_tokens
+            news_tokens = _count_batch_news_tokens(news, content, 0) + _OPENAI_MAX_TOKENS
+        batch.append(news)
+        total_tokens += news_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _parse_batch_answer(answer: str, news_num: int) -> Dict[int, str]:
+    """Returns the summaries by the index of the news, or empty if the answer is malformed."""
+    # The json object may be wrapped with extra words or markdown fences
+    json_begin, json_end = answer.find('{'), answer.rfind('}')
+    if json_begin < 0 or json_end < json_begin:
+        return {}
+    try:
+        answer_json = json.loads(answer[json_begin:json_end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(answer_json, dict):
+        return {}
+    brief_contents = {}
+    for index in range(news_num):
+        brief_content = answer_json.get(str(index + 1))
+        if not isinstance(brief_content, str) or not brief_content.strip():
+            return {}
+        brief_contents[index] = brief_content.strip()
+    return brief_contents
+
+
+def _summarize_batch_with_gpt(news_list: List[News], retry_times: int,
+                              delay: float) -> List[Optional[News]]:
+    if len(news_list) == 1:
+        return [summarize_news_with_gpt(news=news_list[0], retry_times=retry_times, delay=delay)]
+    answer = _create_chat_completion(
+        question=_get_batch_question(news_list, [_truncate_content(news) for news in news_list]),
+        max_tokens=_OPENAI_MAX_TOKENS * len(news_list),
+        retry_times=retry_times,
+        delay=delay)
+    brief_contents = _parse_batch_answer(answer, len(news_list)) if answer else {}
+    if not brief_contents:
+        # Split the batch and retry the halves, until falling back to single requests
+        logging.warning('Failed to parse the batch answer for {} news, split it: {}'.format(
+            len(news_list), answer))
+        half = len(news_list) // 2
+        return _summarize_batch_with_gpt(news_list[:half], retry_times,
+                                         delay) + _summarize_batch_with_gpt(
+                                             news_list[half:], retry_times, delay)
+    news_list_with_summary: List[Optional[News]] = []
+    for index, news in enumerate(news_list):
+        news_with_summary = dataclasses.replace(news)
+        news_with_summary.brief_content = brief_contents[index]
+        news_list_with_summary.append(news_with_summary)
+        logging.info('Summarized content for {} in {} chinese characters.'.format(
+            news.title, count_chinese_chars(news_with_summary.brief_content)))
+    return news_list_with_summary
+
+
+def summarize_news_list_with_gpt(
+        news_list: List[News],
+        batch_size: int = 1,
+        retry_times: int = 3,
+        delay: float = 25,
+        is_enough: Optional[Callable[[List[News]], bool]] = None,
+) -> List[News]:
+    """Summarizes several news per request, keeping the order and skipping the failed ones.
+
+    Batches are requested concurrently, one per member of the openai pool, and the pool keeps
+    each member within its own rate limit. With is_enough, the batches go in rounds of one per
+    member, and no more requests are issued once the news summarized so far are enough.
+    """
+    if _openai_pool is None:
+        raise ValueError('Call init_openai before requesting openai')
+    batches = _pack_batches(news_list, batch_size)
+    logging.info('Summarizing {} news in {} batches with {} openai pool members.'.format(
+        len(news_list), len(batches), len(_openai_pool.members)))
+    round_size = len(_openai_pool.members) if is_enough else max(len(batches), 1)
+    news_list_with_summary: List[News] = []
+    with ThreadPoolExecutor(max_workers=len(_openai_pool.members)) as executor:
+        for round_start in range(0, len(batches), round_size):
+            batch_results = list(
+                executor.map(lambda batch: _summarize_batch_with_gpt(batch, retry_times, delay),
+                             batches[round_start:round_start + round_size]))
+            for batch_result in batch_results:
+                for news_with_summary in batch_result:
+                    if news_with_summary:
+                        news_list_with_summary.append(news_with_summary)
+            if is_enough and is_enough(news_list_with_summary):
+                logging.info('Stop summarizing with {} news, which are enough.'.format(
+                    len(news_list_with_summary)))
+                break
+    return news_list_with_summary
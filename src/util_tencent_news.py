@@ -3,13 +3,15 @@
 import dataclasses
 from datetime import datetime, timedelta
 import logging
-from pathlib import Path
-from typing import List, Set
+from typing import List, Optional, Set
 
 from bs4 import BeautifulSoup
+from requests.exceptions import RequestException
 
 from class_news import News
 from util import count_chinese_chars
+from util_dedup import remove_near_duplicate_news
+from util_news_source import NewsSourcePlugin
 from util_request import request_get
 
 _PAGE_SIZE = 20
@@ -17,6 +19,8 @@ _HOT_RANKING_LIST_URL = 'https://r.inews.qq.com/gw/event/hot_ranking_list'
 _MAX_HOURS_DIFF_ALLOWED = 24
 _MAX_TITLE_CHINESE_CHARS = 35
 _MAX_CONTENT_CHINESE_CHARS = 3200
+# Titles are short, so only nearly identical ones are merged before fetching their contents
+_TITLE_DEDUP_THRESHOLD = 0.8
 
 
 def _get_news_list_without_content() -> List[News]:
@@ -110,56 +114,39 @@ def _parse_news_content_from_html(raw_html: str) -> str:
     return content
 
 
-def _fetch_news_content(news_list_without_content: List[News], news_num: int) -> List[News]:
-    news_list: List[News] = []
-    for news in news_list_without_content:
-        raw_news_article_response = request_get(url=news.url)
+class TencentNewsSource(NewsSourcePlugin):
+
+    name = 'tencent'
+
+    def __init__(self, dedup_threshold: float):
+        self.dedup_threshold = dedup_threshold
+
+    def get_candidates(self) -> List[News]:
+        return remove_near_duplicate_news(
+            _get_news_list_without_content(),
+            threshold=max(self.dedup_threshold, _TITLE_DEDUP_THRESHOLD),
+            with_content=False)
+
+    def fetch_content(self, news: News) -> Optional[News]:
+        try:
+            raw_news_article_response = request_get(url=news.url)
+        except RequestException as exception:
+            logging.error('Failed to request news content from url {}, skip it: {}'.format(
+                news.url, exception))
+            return None
         raw_news_article_html = raw_news_article_response.text
         news_with_content = dataclasses.replace(news)
         try:
             news_with_content.content = _parse_news_content_from_html(raw_news_article_html)
-        except Exception as exception:
-            raise ValueError('Failed to parse news content from url {}'.format(
-                news.url)) from exception
+        except Exception as exception:  # pylint: disable=broad-except
+            logging.error('Failed to parse news content from url {}, skip it: {}'.format(
+                news.url, exception))
+            return None
 
         # Check content length
         if count_chinese_chars(news_with_content.content) > _MAX_CONTENT_CHINESE_CHARS:
             logging.warning(
                 'The origin content is too long with {} chinese chars, while we have a limit of {}'.  # pylint: disable=line-too-long
                 format(count_chinese_chars(news_with_content.content), _MAX_CONTENT_CHINESE_CHARS))
-            continue
-
-        news_list.append(news_with_content)
-        logging.info('Got the content of the news: {} [{}]'.format(news.title, len(news_list)))
-        if len(news_list) >= news_num:
-            break
-    return news_list
-
-
-def _fetch_news_image(news_list_without_image: List[News], image_dir_path: Path) -> List[News]:
-    news_list: List[News] = []
-    for index, news in enumerate(news_list_without_image):
-        if not news.image_path:
-            logging.warning(
-                'There is no cover image for the news {}, skip download its image.'.format(
-                    news.title))
-            news_list.append(news)
-            continue
-        raw_news_image_response = request_get(url=news.image_path)
-        image_extension = raw_news_image_response.headers.get('content-type',
-                                                              '').split('/')[-1] or 'webp'
-        image_path = image_dir_path / f'{str(index).zfill(2)}.{image_extension}'
-        image_path.write_bytes(raw_news_image_response.content)
-        news_with_image = dataclasses.replace(news)
-        news_with_image.image_path = str(image_path)
-        news_list.append(news_with_image)
-        logging.info('Downloaded the image of the news: {} [{}/{}] to {}'.format(
-            news.title, index + 1, len(news_list_without_image), str(image_path)))
-    return news_list
-
-
-def get_tencent_hot_ranking_list(news_num: int, image_dir_path: Path) -> List[News]:
-    news_list_without_content = _get_news_list_without_content()
-    news_list_without_image = _fetch_news_content(news_list_without_content, news_num)
-    news_list = _fetch_news_image(news_list_without_image, image_dir_path)
-    return news_list
+            return None
+        return news_with_content
@@ -0,0 +1,35 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import functools
+
+import tiktoken
+
+_SENTENCE_END_MARKS = ('。', '！', '？', '!', '?', '\n')
+_TEXT_TOKEN_COUNT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(model)
+
+
+@functools.lru_cache(maxsize=_TEXT_TOKEN_COUNT_CACHE_SIZE)
+def count_tokens(txt: str, model: str) -> int:
+    return len(_get_encoding(model).encode(txt))
+
+
+def truncate_to_tokens(txt: str, max_tokens: int, model: str) -> str:
+    """Cuts the text at the last sentence end within the token budget in linear time.
+
+    If there is no sentence end within the budget, the text is cut at the budget itself.
+    """
+    encoding = _get_encoding(model)
+    tokens = encoding.encode(txt)
+    if len(tokens) <= max_tokens:
+        return txt
+    # A token may end in the middle of a multi-byte Chinese character, drop the broken tail
+    prefix = encoding.decode(tokens[:max(max_tokens, 0)]).rstrip('�')
+    sentence_end_index = max(prefix.rfind(mark) for mark in _SENTENCE_END_MARKS)
+    if sentence_end_index < 0:
+        return prefix
+    return prefix[:sentence_end_index + 1]
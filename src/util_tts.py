@@ -1,19 +1,37 @@
 # Copyright @2023. All rights reserved.
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import asyncio
 import dataclasses
 import logging
+import re
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, List, Optional, Set, Tuple
 
 from edge_tts import Communicate, list_voices
 
 from class_news import News
+from util import count_chinese_chars
+from util_mp3 import concat_mp3_with_gaps, get_mp3_duration
+
+# Split after sentence ends, but keep closing quotes with their sentences
+_SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？；!?;\n][”’」』])|(?<=[。！？；!?;\n])(?![”’」』])')
+_CHUNK_RETRY_TIMES = 3
+_CHUNK_RETRY_DELAY = 1
+
+_SUPPORTED_EDGE_TTS_VOICES: Set[str] = set()
+
+
+async def _get_supported_edge_tts_voices() -> Set[str]:
+    # The voice list rarely changes, so download it only once per process
+    if not _SUPPORTED_EDGE_TTS_VOICES:
+        _SUPPORTED_EDGE_TTS_VOICES.update(
+            filter(lambda voice: voice.startswith('zh-'),
+                   {v['ShortName'] for v in await list_voices()}))
+    return _SUPPORTED_EDGE_TTS_VOICES
 
 
 async def validate_edge_tts_voices(voices: List[str]):
-    supported_edge_tts_voices = {v['ShortName'] for v in await list_voices()}
-    supported_edge_tts_voices = set(
-        filter(lambda voice: voice.startswith('zh-'), supported_edge_tts_voices))
+    supported_edge_tts_voices = await _get_supported_edge_tts_voices()
     unsupported_voices = [v for v in voices if v not in supported_edge_tts_voices]
     if unsupported_voices:
         raise ValueError('Unsupported voices: {}. All supported voices are: {}'.format(
@@ -31,20 +49,194 @@ async def _read_with_edge_tts(txt: str, audio_path: Path, voice: str, rate: str,
     await tts.save(str(audio_path))
 
 
-async def read_news_with_edge_tts(news: News, audio_path: Path, voice: str, rate: str,
-                                  volume: str) -> News:
-    await _read_with_edge_tts(
-        txt='{}\n\n{}'.format(news.title, news.brief_content),
+def _split_sentences_with_offsets(txt: str) -> List[Tuple[int, str]]:
+    """Returns the sentences of split_sentences, each with its offset in the text."""
+    sentences: List[Tuple[int, str]] = []
+    offset = 0
+    for end in [match.start() for match in _SENTENCE_END_PATTERN.finditer(txt)] + [len(txt)]:
+        sentence = txt[offset:end].strip()
+        # Nothing to speak, e.g. the closing quote of a quoted sentence
+        if sentences and sentence and not re.search(r'\w', sentence):
+            sentences[-1] = (sentences[-1][0], sentences[-1][1] + sentence)
+        elif sentence:
+            sentences.append((offset, sentence))
+        offset = end
+    return sentences
+
+
+def split_sentences(txt: str) -> List[str]:
+    """Splits the text after chinese sentence punctuations, keeping the punctuations."""
+    return [sentence for _, sentence in _split_sentences_with_offsets(txt)]
+
+
+class StreamingSentenceSplitter():
+    """Splits text arriving piece by piece into the same sentences as split_sentences.
+
+    The last sentence may still grow, so a sentence is only complete once a sentence with
+    something to speak follows it. Only the text of that last sentence is kept, so that the
+    completed ones are not split again for every piece.
+    """
+
+    def __init__(self):
+        self.txt = ''
+
+    def feed(self, txt: str) -> List[str]:
+        """Returns the newly completed sentences."""
+        self.txt += txt
+        sentences = _split_sentences_with_offsets(self.txt)
+        if len(sentences) < 2:
+            return []
+        self.txt = self.txt[sentences[-1][0]:]
+        return [sentence for _, sentence in sentences[:-1]]
+
+    def flush(self) -> List[str]:
+        """Returns the remaining sentences at the end of the text."""
+        remaining_sentences = split_sentences(self.txt)
+        self.txt = ''
+        return remaining_sentences
+
+
+async def _synthesize_with_edge_tts(txt: str, voice: str, rate: str, volume: str) -> bytes:
+    for retry_index in range(_CHUNK_RETRY_TIMES):
+        try:
+            tts = Communicate(text=txt, voice=voice, rate=rate, volume=volume)
+            audio_chunks = [
+                message['data'] async for message in tts.stream() if message['type'] == 'audio'
+            ]
+            return b''.join(audio_chunks)
+        except Exception as exception:  # pylint: disable=broad-except
+            if retry_index == _CHUNK_RETRY_TIMES - 1:
+                raise
+            logging.warning('Failed to synthesize {}, retry it: {}'.format(txt, exception))
+            await asyncio.sleep(_CHUNK_RETRY_DELAY * (retry_index + 1))
+    return b''
+
+
+async def read_sentence_stream_with_edge_tts(sentences: AsyncIterator[str], audio_path: Path,
+                                             voice: str, rate: str, volume: str, gap_secs: float,
+                                             concurrency: int) -> float:
+    """Synthesizes each sentence as soon as it arrives and joins them with gaps in order.
+
+    Returns the duration of the audio.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def synthesize(sentence: str) -> bytes:
+        async with semaphore:
+            return await _synthesize_with_edge_tts(
+                txt=sentence, voice=voice, rate=rate, volume=volume)
+
+    tasks = []
+    try:
+        async for sentence in sentences:
+            tasks.append(asyncio.ensure_future(synthesize(sentence)))
+        segments = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    audio = concat_mp3_with_gaps(list(segments), gap_secs)
+    audio_path.write_bytes(audio)
+    return get_mp3_duration(audio)
+
+
+async def _iterate_list(items: List[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+
+async def read_sentences_with_edge_tts(sentences: List[str], audio_path: Path, voice: str,
+                                       rate: str, volume: str, gap_secs: float,
+                                       concurrency: int) -> float:
+    """Synthesizes the sentences concurrently and joins them with gaps, returning the duration."""
+    return await read_sentence_stream_with_edge_tts(
+        sentences=_iterate_list(sentences),
         audio_path=audio_path,
         voice=voice,
         rate=rate,
-        volume=volume)
+        volume=volume,
+        gap_secs=gap_secs,
+        concurrency=concurrency)
+
+
+async def read_news_with_edge_tts(news: News,
+                                  audio_path: Path,
+                                  voice: str,
+                                  rate: str,
+                                  volume: str,
+                                  chunked: bool = False,
+                                  gap_secs: float = 0.3,
+                                  concurrency: int = 4) -> News:
+    if chunked:
+        audio_duration = await read_sentences_with_edge_tts(
+            sentences=[news.title] + split_sentences(news.brief_content),
+            audio_path=audio_path,
+            voice=voice,
+            rate=rate,
+            volume=volume,
+            gap_secs=gap_secs,
+            concurrency=concurrency)
+    else:
+        await _read_with_edge_tts(
+            txt='{}\n\n{}'.format(news.title, news.brief_content),
+            audio_path=audio_path,
+            voice=voice,
+            rate=rate,
+            volume=volume)
+        audio_duration = get_mp3_duration(audio_path.read_bytes())
     news_with_audio = dataclasses.replace(news)
     news_with_audio.audio_path = str(audio_path)
+    news_with_audio.audio_duration = audio_duration
     logging.info('Read content for {} to {}.'.format(news.title, str(audio_path)))
     return news_with_audio
 
 
+async def read_news_summary_stream_with_edge_tts(news: News,
+                                                 brief_content_pieces: AsyncIterator[str],
+                                                 audio_path: Path,
+                                                 voice: str,
+                                                 rate: str,
+                                                 volume: str,
+                                                 gap_secs: float = 0.3,
+                                                 concurrency: int = 4) -> Optional[News]:
+    """Reads the summary while it is being generated, sentence by sentence.
+
+    The brief content and the audio are the same as summarizing first and then reading the news
+    in chunks. Returns None if the summary is empty.
+    """
+    brief_content_pieces_read: List[str] = []
+
+    async def generate_sentences() -> AsyncIterator[str]:
+        yield news.title
+        splitter = StreamingSentenceSplitter()
+        async for brief_content_piece in brief_content_pieces:
+            brief_content_pieces_read.append(brief_content_piece)
+            for sentence in splitter.feed(brief_content_piece):
+                yield sentence
+        for sentence in splitter.flush():
+            yield sentence
+
+    audio_duration = await read_sentence_stream_with_edge_tts(
+        sentences=generate_sentences(),
+        audio_path=audio_path,
+        voice=voice,
+        rate=rate,
+        volume=volume,
+        gap_secs=gap_secs,
+        concurrency=concurrency)
+    brief_content = ''.join(brief_content_pieces_read)
+    if not brief_content:
+        logging.error('No summary from the stream, the news will be skipped: {}'.format(news.title))
+        return None
+    news_with_audio = dataclasses.replace(news)
+    news_with_audio.brief_content = brief_content
+    news_with_audio.audio_path = str(audio_path)
+    news_with_audio.audio_duration = audio_duration
+    logging.info('Summarized and read content for {} in {} chinese characters to {}.'.format(
+        news.title, count_chinese_chars(brief_content), str(audio_path)))
+    return news_with_audio
+
+
 async def read_text_with_edge_tts(txt: str, audio_path: Path, voice: str, rate: str, volume: str):
     await _read_with_edge_tts(txt=txt, audio_path=audio_path, voice=voice, rate=rate, volume=volume)
     logging.info('Read text to {}.'.format(str(audio_path)))
@@ -1,10 +1,15 @@
 # Copyright @2023. All rights reserved.
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import functools
 import logging
+import math
 import tempfile
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from PIL import Image, ImageFont, ImageDraw
 from moviepy import editor
 
@@ -13,7 +18,6 @@ from class_news import News
 # Global
 _VIDEO_WIDTH = 1280
 _VIDEO_HEIGHT = 720
-_VIDEO_FPS = 50
 _SPACING_LR = _VIDEO_WIDTH * 0.06
 _SPACING_UB = _VIDEO_HEIGHT * 0.08
 _SILENCE_BOUNDARY_SECS = 1
@@ -42,6 +46,85 @@ _CONTENT_SOURCE_SPACING = _VIDEO_HEIGHT * 0.03
 _SOURCE_FONT_SIZE = 18
 _NEWS_SLIDE_FILENAME_FMT = 'news_{}.png'
 
+# Benchmark
+_MAX_PSNR = 100.0
+
+# Preview
+_PREVIEW_PRESET = 'ultrafast'
+_PREVIEW_AUDIO_BITRATE = '64k'
+_CONTACT_SHEET_COLUMNS = 4
+_CONTACT_SHEET_SPACING = 10
+_CONTACT_SHEET_BG_COLOR = '#ccc'
+
+
+@dataclass
+class EncoderProfile():
+    fps: float
+    keyframe_interval_secs: float
+    crf: int
+    preset: str
+    audio_bitrate: str
+    # E.g. 'stillimage', which suits slides that never change within a segment
+    tune: str = ''
+
+    def get_write_videofile_kwargs(self) -> dict:
+        ffmpeg_params = [
+            '-crf',
+            str(self.crf),
+            '-g',
+            str(max(int(self.fps * self.keyframe_interval_secs), 1)),
+        ]
+        if self.tune:
+            ffmpeg_params += ['-tune', self.tune]
+        return dict(
+            fps=self.fps,
+            codec='libx264',
+            preset=self.preset,
+            audio_bitrate=self.audio_bitrate,
+            ffmpeg_params=ffmpeg_params,
+            threads=_FFMPEG_THREADS)
+
+
+ENCODER_PROFILES: Dict[str, EncoderProfile] = {
+    # The same as the defaults of moviepy and x264 used before profiles were added
+    'legacy':
+    EncoderProfile(
+        fps=50, keyframe_interval_secs=5, crf=23, preset='medium', audio_bitrate='128k'),
+    'still':
+    EncoderProfile(
+        fps=10,
+        keyframe_interval_secs=10,
+        crf=23,
+        preset='veryfast',
+        audio_bitrate='96k',
+        tune='stillimage'),
+    'still_fast':
+    EncoderProfile(
+        fps=5,
+        keyframe_interval_secs=20,
+        crf=26,
+        preset='superfast',
+        audio_bitrate='64k',
+        tune='stillimage'),
+    'still_hq':
+    EncoderProfile(
+        fps=25,
+        keyframe_interval_secs=5,
+        crf=20,
+        preset='medium',
+        audio_bitrate='128k',
+        tune='stillimage'),
+}
+DEFAULT_ENCODER_PROFILE = 'legacy'
+
+
+@dataclass
+class LayoutOverflow():
+    """A text box of a slide whose text does not fit in."""
+    slide: str
+    text_box: str
+    overflow_chars: int
+
 
 def with_temp_dir_path(func):
 
@@ -52,6 +135,12 @@ def with_temp_dir_path(func):
     return wrapper
 
 
+@functools.lru_cache(maxsize=None)
+def _get_font(font_file_path: Path, size: int) -> ImageFont.FreeTypeFont:
+    # Loading a font file is slow, keep it for all slides and runs of a long-running process
+    return ImageFont.truetype(str(font_file_path), size=size)
+
+
 def _get_text_width_and_height(txt: str, font: ImageFont.FreeTypeFont):
     left, top, right, bottom = font.getbbox(txt)
     return right - left, bottom - top
@@ -63,7 +152,8 @@ def _add_text_box_with_word_wrap(draw: ImageDraw,
                                  font: ImageFont.FreeTypeFont,
                                  fill_color=_BLACK_COLOR,
                                  line_spacing: float = 0.25,
-                                 align: str = 'left'):
+                                 align: str = 'left') -> int:
+    """Returns the number of chars which do not fit in the box, 0 if all of them fit."""
     curr_x, curr_y, max_x, max_y = bbox[0], bbox[1], bbox[2], bbox[3]
     index = 0
     while index < len(txt):
@@ -77,20 +167,21 @@ def _add_text_box_with_word_wrap(draw: ImageDraw,
         _, curr_line_height = _get_text_width_and_height(curr_line_txt, font)
         if curr_y + curr_line_height > max_y:
             logging.warning('Textbox overflows by {} words'.format(len(txt) - index))
-            return
+            return len(txt) - index
         draw.text((curr_x, curr_y), curr_line_txt, font=font, align=align, fill=fill_color)
         index += char_count
         curr_y += curr_line_height * (1 + line_spacing)
+    return 0
 
 
 def _generate_cover_slide(news_list: List[News], date: str, font_file_path: Path,
-                          cover_slide_file_path: Path):
+                          cover_slide_file_path: Path) -> List[LayoutOverflow]:
     canvas = Image.new('RGBA', (_VIDEO_WIDTH, _VIDEO_HEIGHT), _WHITE_COLOR)
     draw = ImageDraw.Draw(canvas)
 
     # Title
     title_txt = '《十分热》每日新闻'
-    title_font = ImageFont.truetype(str(font_file_path), size=_COVER_TITLE_FONT_SIZE)
+    title_font = _get_font(font_file_path, _COVER_TITLE_FONT_SIZE)
     _, _, title_width, title_height = draw.textbbox(
         (0, 0), title_txt, font=title_font, align='center')
     draw.text(
@@ -103,7 +194,7 @@ def _generate_cover_slide(news_list: List[News], date: str, font_file_path: Path
 
     # Date
     date_txt = date
-    date_font = ImageFont.truetype(str(font_file_path), size=_COVER_DATE_FONT_SIZE)
+    date_font = _get_font(font_file_path, _COVER_DATE_FONT_SIZE)
     _, _, date_width, date_height = draw.textbbox((0, 0), date_txt, font=date_font, align='center')
     draw.text(
         ((_VIDEO_WIDTH / 3 - date_width) / 2,
@@ -125,20 +216,29 @@ def _generate_cover_slide(news_list: List[News], date: str, font_file_path: Path
                            str(len(news_list)).zfill(2), news.title)
         for index, news in enumerate(news_list)
     ])
-    toc_font = ImageFont.truetype(str(font_file_path), size=_COVER_TOC_FONT_SIZE)
-    draw.text(
-        (_VIDEO_WIDTH / 3 + _COVER_TOC_X_OFFSET, _SPACING_UB + _COVER_TOC_Y_OFFSET),
-        toc_txt,
-        font=toc_font,
-        align='left',
-        fill=_BLACK_COLOR)
+    toc_font = _get_font(font_file_path, _COVER_TOC_FONT_SIZE)
+    toc_position = (_VIDEO_WIDTH / 3 + _COVER_TOC_X_OFFSET, _SPACING_UB + _COVER_TOC_Y_OFFSET)
+    draw.text(toc_position, toc_txt, font=toc_font, align='left', fill=_BLACK_COLOR)
+    layout_overflows = []
+    toc_lines = toc_txt.split('\n')
+    for index in range(len(toc_lines)):
+        _, _, _, toc_bottom = draw.multiline_textbbox(
+            toc_position, '\n'.join(toc_lines[:index + 1]), font=toc_font, align='left')
+        if toc_bottom > _VIDEO_HEIGHT - _SPACING_UB:
+            overflow_chars = sum(len(line) for line in toc_lines[index:])
+            logging.warning('The toc of the cover overflows by {} lines'.format(
+                len(toc_lines) - index))
+            layout_overflows.append(
+                LayoutOverflow(slide='cover', text_box='toc', overflow_chars=overflow_chars))
+            break
 
     canvas.save(str(cover_slide_file_path))
     logging.info('Exported temp cover slide to {}'.format(str(cover_slide_file_path)))
+    return layout_overflows
 
 
 def _generate_news_slide(news: News, news_index: int, news_length: int, font_file_path: Path,
-                         news_slide_file_path: Path):
+                         news_slide_file_path: Path) -> List[LayoutOverflow]:
     # TODO: Support background image
     canvas = Image.new('RGBA', (_VIDEO_WIDTH, _VIDEO_HEIGHT), _WHITE_COLOR)
     draw = ImageDraw.Draw(canvas)
@@ -156,8 +256,9 @@ def _generate_news_slide(news: News, news_index: int, news_length: int, font_fil
     caption_txt = '【{}/{}】{}'.format(
         str(news_index + 1).zfill(2),
         str(news_length).zfill(2), news.title)
-    caption_font = ImageFont.truetype(str(font_file_path), size=_CAPTION_FONT_SIZE)
-    _add_text_box_with_word_wrap(
+    caption_font = _get_font(font_file_path, _CAPTION_FONT_SIZE)
+    overflow_chars_by_text_box = {}
+    overflow_chars_by_text_box['caption'] = _add_text_box_with_word_wrap(
         draw=draw,
         bbox=(_SPACING_LR, _SPACING_UB, _VIDEO_WIDTH - _SPACING_LR,
               _SPACING_UB + _CAPTION_BBOX_HEIGHT),
@@ -166,7 +267,7 @@ def _generate_news_slide(news: News, news_index: int, news_length: int, font_fil
 
     # Content
     content_txt = news.brief_content
-    content_font = ImageFont.truetype(str(font_file_path), size=_CONTENT_FONT_SIZE)
+    content_font = _get_font(font_file_path, _CONTENT_FONT_SIZE)
     if has_image:
         content_bbox = (
             _SPACING_LR,
@@ -181,7 +282,7 @@ def _generate_news_slide(news: News, news_index: int, news_length: int, font_fil
             _VIDEO_WIDTH - _SPACING_LR,
             _SPACING_UB + _CAPTION_BBOX_HEIGHT + _CAPTION_CONTENT_SPACING + _CONTENT_BBOX_HEIGHT,
         )
-    _add_text_box_with_word_wrap(
+    overflow_chars_by_text_box['content'] = _add_text_box_with_word_wrap(
         draw=draw,
         bbox=content_bbox,
         txt=content_txt,
@@ -203,8 +304,8 @@ def _generate_news_slide(news: News, news_index: int, news_length: int, font_fil
 
     # Source
     content_txt = f'来源：{news.source_name} {news.url}'
-    content_font = ImageFont.truetype(str(font_file_path), size=_SOURCE_FONT_SIZE)
-    _add_text_box_with_word_wrap(
+    content_font = _get_font(font_file_path, _SOURCE_FONT_SIZE)
+    overflow_chars_by_text_box['source'] = _add_text_box_with_word_wrap(
         draw=draw,
         bbox=(_SPACING_LR, _SPACING_UB + _CAPTION_BBOX_HEIGHT + _CAPTION_CONTENT_SPACING +
               _CONTENT_BBOX_HEIGHT + _CONTENT_SOURCE_SPACING, _VIDEO_WIDTH - _SPACING_LR,
@@ -215,36 +316,50 @@ def _generate_news_slide(news: News, news_index: int, news_length: int, font_fil
     canvas.save(str(news_slide_file_path))
     logging.info('Exported temp news slide for {} to {}'.format(news.title,
                                                                 str(news_slide_file_path)))
+    return [
+        LayoutOverflow(
+            slide='news {}'.format(str(news_index + 1).zfill(2)),
+            text_box=text_box,
+            overflow_chars=overflow_chars)
+        for text_box, overflow_chars in overflow_chars_by_text_box.items()
+        if overflow_chars > 0
+    ]
 
 
-@with_temp_dir_path
-def generate_news_video(news_list: List[News],
-                        date: str,
-                        cover_audio_file_path: Path,
-                        ending_audio_file_path: Path,
-                        font_file_path: Path,
-                        video_file_path: Path,
-                        cover_file_path: Path,
-                        temp_dir_path: Optional[Path] = None):
-    if temp_dir_path is None:
-        raise ValueError('Temp dir path cannot be none')
-    bg_white_clip = editor.ColorClip(size=(_VIDEO_WIDTH, _VIDEO_HEIGHT), color=_WHITE_COLOR)
-    curr_timestamp = 0
-
-    # Generate slides
-    _generate_cover_slide(
+def _generate_slides(news_list: List[News], date: str, font_file_path: Path,
+                     cover_file_path: Path, temp_dir_path: Path) -> List[LayoutOverflow]:
+    """Generates the cover and all news slides, returning the text boxes which overflowed."""
+    layout_overflows = _generate_cover_slide(
         news_list=news_list,
         date=date,
         font_file_path=font_file_path,
         cover_slide_file_path=cover_file_path)
     for index, news in enumerate(news_list):
-        _generate_news_slide(
+        layout_overflows += _generate_news_slide(
             news=news,
             news_index=index,
             news_length=len(news_list),
             font_file_path=font_file_path,
             news_slide_file_path=temp_dir_path / _NEWS_SLIDE_FILENAME_FMT.format(
                 str(index).zfill(2)))
+    return layout_overflows
+
+
+def _get_slide_file_paths(news_list: List[News], cover_file_path: Path,
+                          temp_dir_path: Path) -> List[Path]:
+    return [cover_file_path] + [
+        temp_dir_path / _NEWS_SLIDE_FILENAME_FMT.format(str(index).zfill(2))
+        for index in range(len(news_list))
+    ]
+
+
+def _compose_news_video_clip(
+        news_list: List[News], cover_audio_file_path: Path, ending_audio_file_path: Path,
+        cover_file_path: Path,
+        temp_dir_path: Path) -> Tuple[editor.VideoClip, List[Tuple[float, float]]]:
+    """Returns the video clip of the generated slides, and the start and end of every slide."""
+    bg_white_clip = editor.ColorClip(size=(_VIDEO_WIDTH, _VIDEO_HEIGHT), color=_WHITE_COLOR)
+    curr_timestamp = 0
 
     # Cover
     cover_slide_clip = editor.ImageClip(str(cover_file_path))
@@ -299,8 +414,201 @@ def generate_news_video(news_list: List[News],
         [cover_audio_clip, *news_audio_clips, ending_audio_clip])
     final_video_clip = final_video_clip.set_audio(final_audio_clip)
 
-    final_video_clip.write_videofile(str(video_file_path), fps=_VIDEO_FPS, threads=_FFMPEG_THREADS)
+    slide_clips = [cover_slide_clip, *news_slide_clips, ending_slide_clip]
+    slide_spans = [(clip.start, clip.start + clip.duration) for clip in slide_clips]
+    return final_video_clip, slide_spans
+
+
+@with_temp_dir_path
+def generate_news_video(news_list: List[News],
+                        date: str,
+                        cover_audio_file_path: Path,
+                        ending_audio_file_path: Path,
+                        font_file_path: Path,
+                        video_file_path: Path,
+                        cover_file_path: Path,
+                        encoder_profile_name: str = DEFAULT_ENCODER_PROFILE,
+                        temp_dir_path: Optional[Path] = None) -> List[LayoutOverflow]:
+    if temp_dir_path is None:
+        raise ValueError('Temp dir path cannot be none')
+    layout_overflows = _generate_slides(
+        news_list=news_list,
+        date=date,
+        font_file_path=font_file_path,
+        cover_file_path=cover_file_path,
+        temp_dir_path=temp_dir_path)
+    final_video_clip, _ = _compose_news_video_clip(
+        news_list=news_list,
+        cover_audio_file_path=cover_audio_file_path,
+        ending_audio_file_path=ending_audio_file_path,
+        cover_file_path=cover_file_path,
+        temp_dir_path=temp_dir_path)
+    final_video_clip.write_videofile(
+        str(video_file_path), **ENCODER_PROFILES[encoder_profile_name].get_write_videofile_kwargs())
     logging.info('Generated news video to {}'.format(str(video_file_path)))
+    return layout_overflows
+
+
+def format_layout_report(layout_overflows: List[LayoutOverflow]) -> str:
+    if not layout_overflows:
+        return 'Layout report: all text boxes fit.'
+    return '\n'.join(['Layout report: {} text boxes overflowed.'.format(len(layout_overflows))] + [
+        '  {}: {} overflows by {} chars'.format(overflow.slide, overflow.text_box,
+                                                overflow.overflow_chars)
+        for overflow in layout_overflows
+    ])
+
+
+def _get_even_size(scale: float) -> Tuple[int, int]:
+    # Dimensions of yuv420p videos must be even
+    return (max(int(_VIDEO_WIDTH * scale) // 2 * 2, 2), max(int(_VIDEO_HEIGHT * scale) // 2 * 2, 2))
+
+
+def _generate_contact_sheet(slide_file_paths: List[Path], contact_sheet_file_path: Path,
+                            scale: float):
+    thumbnail_width, thumbnail_height = _get_even_size(scale)
+    rows = math.ceil(len(slide_file_paths) / _CONTACT_SHEET_COLUMNS)
+    contact_sheet = Image.new(
+        'RGB', (_CONTACT_SHEET_COLUMNS * (thumbnail_width + _CONTACT_SHEET_SPACING) +
+                _CONTACT_SHEET_SPACING, rows *
+                (thumbnail_height + _CONTACT_SHEET_SPACING) + _CONTACT_SHEET_SPACING),
+        _CONTACT_SHEET_BG_COLOR)
+    for index, slide_file_path in enumerate(slide_file_paths):
+        thumbnail = Image.open(slide_file_path).convert('RGB').resize(
+            (thumbnail_width, thumbnail_height))
+        row, column = divmod(index, _CONTACT_SHEET_COLUMNS)
+        contact_sheet.paste(
+            thumbnail, (_CONTACT_SHEET_SPACING + column *
+                        (thumbnail_width + _CONTACT_SHEET_SPACING), _CONTACT_SHEET_SPACING + row *
+                        (thumbnail_height + _CONTACT_SHEET_SPACING)))
+    contact_sheet.save(str(contact_sheet_file_path))
+    logging.info('Generated the contact sheet of {} slides to {}'.format(
+        len(slide_file_paths), str(contact_sheet_file_path)))
+
+
+@with_temp_dir_path
+def generate_news_preview(news_list: List[News],
+                          date: str,
+                          cover_audio_file_path: Path,
+                          ending_audio_file_path: Path,
+                          font_file_path: Path,
+                          preview_file_path: Optional[Path],
+                          contact_sheet_file_path: Optional[Path],
+                          scale: float,
+                          fps: float,
+                          segment_secs: Optional[float] = None,
+                          temp_dir_path: Optional[Path] = None) -> List[LayoutOverflow]:
+    """Renders a downscaled low fps video and/or a contact sheet of all slides for layout checks.
+
+    With segment_secs, only the beginning of every slide is rendered. The cover is generated in
+    the temp dir, so the files of the edition are never touched.
+    """
+    if temp_dir_path is None:
+        raise ValueError('Temp dir path cannot be none')
+    cover_file_path = temp_dir_path / 'cover.png'
+    layout_overflows = _generate_slides(
+        news_list=news_list,
+        date=date,
+        font_file_path=font_file_path,
+        cover_file_path=cover_file_path,
+        temp_dir_path=temp_dir_path)
+    if contact_sheet_file_path:
+        _generate_contact_sheet(
+            slide_file_paths=_get_slide_file_paths(news_list, cover_file_path, temp_dir_path),
+            contact_sheet_file_path=contact_sheet_file_path,
+            scale=scale)
+    if preview_file_path:
+        final_video_clip, slide_spans = _compose_news_video_clip(
+            news_list=news_list,
+            cover_audio_file_path=cover_audio_file_path,
+            ending_audio_file_path=ending_audio_file_path,
+            cover_file_path=cover_file_path,
+            temp_dir_path=temp_dir_path)
+        if segment_secs:
+            final_video_clip = editor.concatenate_videoclips([
+                final_video_clip.subclip(start, min(end, start + segment_secs))
+                for start, end in slide_spans
+            ])
+        final_video_clip = final_video_clip.resize(newsize=_get_even_size(scale))
+        final_video_clip.write_videofile(
+            str(preview_file_path),
+            fps=fps,
+            codec='libx264',
+            preset=_PREVIEW_PRESET,
+            audio_bitrate=_PREVIEW_AUDIO_BITRATE,
+            threads=_FFMPEG_THREADS)
+        logging.info('Generated the preview video to {}'.format(str(preview_file_path)))
+    return layout_overflows
+
+
+def _get_psnr(reference_frame: np.ndarray, frame: np.ndarray) -> float:
+    mse = np.mean((reference_frame.astype(np.float64) - frame.astype(np.float64))**2)
+    if mse == 0:
+        return _MAX_PSNR
+    return min(10 * math.log10(255**2 / mse), _MAX_PSNR)
+
+
+@with_temp_dir_path
+def benchmark_encoder_profiles(news_list: List[News],
+                               date: str,
+                               cover_audio_file_path: Path,
+                               ending_audio_file_path: Path,
+                               font_file_path: Path,
+                               output_dir_path: Path,
+                               profile_names: List[str],
+                               duration_secs: Optional[float] = None,
+                               temp_dir_path: Optional[Path] = None) -> List[dict]:
+    """Renders the edition with every profile, reporting encode time, file size and quality.
+
+    The quality is the mean PSNR against the lossless composed frames in the middle of slides.
+    """
+    if temp_dir_path is None:
+        raise ValueError('Temp dir path cannot be none')
+    _generate_slides(
+        news_list=news_list,
+        date=date,
+        font_file_path=font_file_path,
+        cover_file_path=temp_dir_path / 'cover.png',
+        temp_dir_path=temp_dir_path)
+    final_video_clip, slide_spans = _compose_news_video_clip(
+        news_list=news_list,
+        cover_audio_file_path=cover_audio_file_path,
+        ending_audio_file_path=ending_audio_file_path,
+        cover_file_path=temp_dir_path / 'cover.png',
+        temp_dir_path=temp_dir_path)
+    slide_middle_timestamps = [(start + end) / 2 for start, end in slide_spans]
+    if duration_secs:
+        final_video_clip = final_video_clip.subclip(0, min(duration_secs,
+                                                           final_video_clip.duration))
+        slide_middle_timestamps = [
+            timestamp for timestamp in slide_middle_timestamps
+            if timestamp < final_video_clip.duration
+        ] or [final_video_clip.duration / 2]
+    reference_frames = [
+        final_video_clip.get_frame(timestamp) for timestamp in slide_middle_timestamps
+    ]
+
+    results = []
+    for profile_name in profile_names:
+        video_file_path = output_dir_path / '{}.mp4'.format(profile_name)
+        start_time = time.time()
+        final_video_clip.write_videofile(
+            str(video_file_path), **ENCODER_PROFILES[profile_name].get_write_videofile_kwargs())
+        encode_secs = time.time() - start_time
+        encoded_video_clip = editor.VideoFileClip(str(video_file_path))
+        psnrs = [
+            _get_psnr(reference_frame, encoded_video_clip.get_frame(timestamp))
+            for reference_frame, timestamp in zip(reference_frames, slide_middle_timestamps)
+        ]
+        encoded_video_clip.close()
+        results.append({
+            'profile': profile_name,
+            'encode_secs': encode_secs,
+            'file_bytes': video_file_path.stat().st_size,
+            'psnr': sum(psnrs) / len(psnrs),
+        })
+        logging.info('Benchmarked encoder profile {}: {}'.format(profile_name, results[-1]))
+    return results
 
 
 def generate_news_video_description(news_list: List[News], date: str, description_file_path: Path):
@@ -2,51 +2,137 @@
 # Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
 import json
 from datetime import datetime
+from enum import Enum
 from pathlib import Path
+from typing import Optional
 
 import click
 
 from util import setup_logging
-from util_bilibili import UtilBilibili
+from util_bilibili import CredentialStatus, UtilBilibili
+from util_bilibili_upload import get_default_upload_state_file_path
+from util_profile import ProfiledGroup
 
 _TITLE_FMT = '《十分热》每日新闻-{date}'
+_INTRA_DAY_TITLE_FMT = '《十分热》每日新闻-{date} {hour}:{minute}加更'
 _TAGS = ['十分热', '新闻', '每日新闻', '时事', '政治', '热点', 'ChatGPT', 'AI']
+_DEFAULT_CREDENTIAL_CACHE_FILE = 'data/bili_credential_cache.json'
 
 _CONFIG = {}
 with open('config.json', 'r') as f:
     _CONFIG = json.loads(f.read())
 
 
-@click.group()
+class UploadMode(Enum):
+    CHUNKED = 'chunked'
+    SIMPLE = 'simple'
+
+
+@click.group(cls=ProfiledGroup)
 def main():
     setup_logging()
 
 
+def _get_title(date: str, edition_time: Optional[str]) -> str:
+    if not edition_time:
+        return _TITLE_FMT.format(date=date)
+    return _INTRA_DAY_TITLE_FMT.format(date=date, hour=edition_time[:2], minute=edition_time[2:])
+
+
+def _init_bilibili():
+    UtilBilibili.init(
+        sessdata=_CONFIG['bili_sessdata'],
+        bili_jct=_CONFIG['bili_jct'],
+        buvid3=_CONFIG['bili_buvid3'],
+    )
+
+
+@main.command()
+@click.option(
+    '--credential_cache_file',
+    default=_DEFAULT_CREDENTIAL_CACHE_FILE,
+    type=click.Path(dir_okay=False))
+@click.option('--credential_cache_ttl_secs', default=3600, type=float)
+@click.pass_context
+def check_credential(ctx: click.Context, credential_cache_file: str,
+                     credential_cache_ttl_secs: float):
+    """Exit with 0 for valid cookies, 1 for invalid ones and 2 for network errors."""
+    _init_bilibili()
+    status = UtilBilibili.check_credential(
+        cache_file_path=Path(credential_cache_file), ttl_secs=credential_cache_ttl_secs)
+    click.echo(status.value)
+    ctx.exit({
+        CredentialStatus.VALID: 0,
+        CredentialStatus.INVALID: 1,
+        CredentialStatus.NETWORK_ERROR: 2,
+    }[status])
+
+
 @main.command()
 @click.option('--video_file', required=True, type=click.Path(dir_okay=False, exists=True))
 @click.option('--cover_file', required=True, type=click.Path(dir_okay=False, exists=True))
 @click.option('--description_file', required=True, type=click.Path(dir_okay=False, exists=True))
 @click.option('--date', default=datetime.now().strftime('%Y%m%d'), type=str)
+@click.option(
+    '--edition_time',
+    type=str,
+    help='HHMM of an intra-day edition, to title it apart from the daily one')
+@click.option(
+    '--upload_mode',
+    type=click.Choice([upload_mode.value for upload_mode in UploadMode]),
+    default='chunked')
+@click.option('--threads', default=3, type=int, help='Parallel streams in chunked mode')
+@click.option(
+    '--state_file',
+    type=click.Path(dir_okay=False),
+    help='Resume state of chunked mode, defaults to {video_file}.upload.json')
+@click.option(
+    '--credential_cache_file',
+    default=_DEFAULT_CREDENTIAL_CACHE_FILE,
+    type=click.Path(dir_okay=False))
+@click.option('--credential_cache_ttl_secs', default=3600, type=float)
 def upload_to_bilibili(
         video_file: str,
         cover_file: str,
         description_file: str,
         date: str,
+        edition_time: Optional[str],
+        upload_mode: str,
+        threads: int,
+        state_file: str,
+        credential_cache_file: str,
+        credential_cache_ttl_secs: float,
 ):
-    UtilBilibili.init(
-        sessdata=_CONFIG['bili_sessdata'],
-        bili_jct=_CONFIG['bili_jct'],
-        buvid3=_CONFIG['bili_buvid3'],
-    )
-    if not UtilBilibili.check_login():
+    _init_bilibili()
+    credential_status = UtilBilibili.check_credential(
+        cache_file_path=Path(credential_cache_file), ttl_secs=credential_cache_ttl_secs)
+    if credential_status == CredentialStatus.INVALID:
         raise ValueError('Unavailable bilibili cookies, please update it.')
+    if credential_status == CredentialStatus.NETWORK_ERROR:
+        raise ConnectionError('Failed to check bilibili cookies due to network errors.')
+    title = _get_title(date, edition_time)
+    video_file_path = Path(video_file)
+    state_file_path = Path(state_file) if state_file else get_default_upload_state_file_path(
+        video_file_path)
     description = Path(description_file).read_text()
-    UtilBilibili.upload(
-        video_file_path=Path(video_file),
-        cover_file_path=Path(cover_file),
-        title=_TITLE_FMT.format(date=date),
-        description=description,
-        tags=_TAGS)
+    if upload_mode == UploadMode.CHUNKED.value:
+        UtilBilibili.upload_in_chunks(
+            video_file_path=video_file_path,
+            cover_file_path=Path(cover_file),
+            title=title,
+            description=description,
+            tags=_TAGS,
+            state_file_path=state_file_path,
+            threads=threads)
+    elif upload_mode == UploadMode.SIMPLE.value:
+        UtilBilibili.upload(
+            video_file_path=video_file_path,
+            cover_file_path=Path(cover_file),
+            title=title,
+            description=description,
+            tags=_TAGS)
+    else:
+        raise ValueError('Unknown upload mode {}'.format(upload_mode))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,7 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import sys
+from pathlib import Path
+
+# The modules import each other by name, the same as when run from src
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
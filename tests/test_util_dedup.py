@@ -0,0 +1,54 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+from class_news import News
+from util_dedup import NearDuplicateIndex, NearDuplicateNewsFilter, remove_near_duplicate_news
+
+_THRESHOLD = 0.5
+
+
+def _make_news(title: str, content: str = '', url: str = '') -> News:
+    return News(title=title,
+                content=content,
+                url=url or title,
+                publish_timestamp=0,
+                request_timestamp=0)
+
+
+def test_index_finds_near_duplicates():
+    index = NearDuplicateIndex(threshold=_THRESHOLD)
+    index.add('a', '国家统计局发布最新数据，五月份居民消费价格同比上涨百分之零点二')
+    index.add('b', '北京今天迎来入夏以来最强降雨，多条道路出现积水')
+    match = index.query('国家统计局发布最新数据：五月份居民消费价格同比上涨百分之零点二。')
+    assert match is not None
+    key, similarity = match
+    assert key == 'a'
+    assert similarity >= _THRESHOLD
+    assert index.query('上海举办国际电影节，多部国产影片入围主竞赛单元') is None
+
+
+def test_index_is_deterministic():
+    # Every index hashes with the same seeded permutations, so that runs dedup the same way
+    txt = '国家统计局发布最新数据'
+    # pylint: disable=protected-access
+    signatures = [NearDuplicateIndex(threshold=_THRESHOLD)._get_signature(txt) for _ in range(2)]
+    assert signatures[0].tolist() == signatures[1].tolist()
+
+
+def test_filter_keeps_the_first_of_a_cluster():
+    news_filter = NearDuplicateNewsFilter(threshold=_THRESHOLD, with_content=False)
+    assert not news_filter.is_duplicate(_make_news('国家统计局：五月份居民消费价格同比上涨0.2%', url='1'))
+    assert news_filter.is_duplicate(_make_news('国家统计局:五月份居民消费价格同比上涨0.2%!', url='2'))
+    assert not news_filter.is_duplicate(_make_news('北京今天迎来入夏以来最强降雨', url='3'))
+
+
+def test_remove_near_duplicate_news_with_content():
+    content = ('据国家统计局消息，五月份全国居民消费价格同比上涨百分之零点二，环比下降百分之零点二。'
+               '其中，城市上涨百分之零点二，农村上涨百分之零点一；食品价格下降百分之一，非食品价格上涨百分之零点六。')
+    news_list = [
+        _make_news('五月CPI同比上涨0.2%', content=content),
+        _make_news('统计局公布五月物价数据', content=content),
+        _make_news('北京迎来强降雨', content='北京今天迎来入夏以来最强降雨，多条道路出现积水。'),
+    ]
+    assert remove_near_duplicate_news(news_list, _THRESHOLD, with_content=False) == news_list
+    assert remove_near_duplicate_news(news_list, _THRESHOLD,
+                                      with_content=True) == [news_list[0], news_list[2]]
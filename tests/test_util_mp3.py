@@ -0,0 +1,57 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import pytest
+
+from util_mp3 import concat_mp3_with_gaps, get_mp3_duration, get_silent_mp3, parse_mp3_frames
+
+# MPEG-2 layer III, 48 kbps, 24 kHz, no crc, the format of edge-tts: 576 samples in 144 bytes
+_HEADER = bytes([0xFF, 0xF3, 0x64, 0xC4])
+_FRAME_LENGTH = 144
+_FRAME_SECS = 576 / 24000
+
+
+def _make_mp3(frame_num: int, fill: int = 0x55) -> bytes:
+    return (_HEADER + bytes([fill]) * (_FRAME_LENGTH - len(_HEADER))) * frame_num
+
+
+def test_parse_mp3_frames():
+    frames = parse_mp3_frames(_make_mp3(3))
+    assert [frame.offset for frame in frames] == [0, 144, 288]
+    assert all(frame.length == _FRAME_LENGTH for frame in frames)
+    assert frames[0].duration == pytest.approx(_FRAME_SECS)
+
+
+def test_parse_mp3_frames_skips_id3v2_and_trailing_tags():
+    # A 20 bytes id3v2 tag, whose size is a synchsafe integer
+    id3v2_tag = b'ID3' + bytes([4, 0, 0, 0, 0, 0, 20]) + bytes(20)
+    data = id3v2_tag + _make_mp3(2) + b'TAG' + bytes(125)
+    frames = parse_mp3_frames(data)
+    assert [frame.offset for frame in frames] == [30, 174]
+
+
+def test_get_mp3_duration():
+    assert get_mp3_duration(_make_mp3(50)) == pytest.approx(50 * _FRAME_SECS)
+    assert get_mp3_duration(b'') == 0
+
+
+def test_get_silent_mp3():
+    silence = get_silent_mp3(_make_mp3(1), secs=0.1)
+    frames = parse_mp3_frames(silence)
+    assert len(frames) == 5
+    assert len(silence) == 5 * _FRAME_LENGTH
+    assert all(silence[frame.offset + 4:frame.offset + frame.length] == bytes(_FRAME_LENGTH - 4)
+               for frame in frames)
+
+
+def test_concat_mp3_with_gaps():
+    first = b'ID3' + bytes([4, 0, 0, 0, 0, 0, 0]) + _make_mp3(2, fill=0x11)
+    second = _make_mp3(3, fill=0x22)
+    concatenated = concat_mp3_with_gaps([first, b'', second], gap_secs=0.1)
+    assert concatenated.startswith(_make_mp3(2, fill=0x11))
+    assert concatenated.endswith(second)
+    assert get_mp3_duration(concatenated) == pytest.approx((2 + 5 + 3) * _FRAME_SECS)
+
+
+def test_concat_mp3_without_gaps():
+    assert concat_mp3_with_gaps([_make_mp3(1), _make_mp3(2)], gap_secs=0) == _make_mp3(3)
+    assert concat_mp3_with_gaps([b''], gap_secs=0.1) == b''
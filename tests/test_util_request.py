@@ -0,0 +1,144 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+# pylint: disable=protected-access
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import util_request
+from util_request import CircuitOpenError, DeadlineExceededError, request_deadline
+
+_HOST = 'news.example.com'
+_URL = 'https://{}/hot'.format(_HOST)
+
+
+def _make_response(status_code: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def _open_circuit(host_state: util_request._HostState):
+    for _ in range(util_request._CIRCUIT_FAILURE_THRESHOLD):
+        assert not host_state.before_request()
+        host_state.on_failure()
+
+
+def test_circuit_opens_after_consecutive_failures():
+    host_state = util_request._HostState(_HOST)
+    for _ in range(util_request._CIRCUIT_FAILURE_THRESHOLD - 1):
+        host_state.on_failure()
+    # A success in between resets the count
+    host_state.on_success(0.1)
+    assert host_state.consecutive_failures == 0
+
+    _open_circuit(host_state)
+    with pytest.raises(CircuitOpenError):
+        host_state.before_request()
+
+
+def test_circuit_lets_a_single_trial_through_when_half_open():
+    host_state = util_request._HostState(_HOST)
+    _open_circuit(host_state)
+    host_state.open_until = time.time() - 1
+
+    assert host_state.before_request()
+    with pytest.raises(CircuitOpenError):
+        host_state.before_request()
+    # A trial ending without a verdict lets the next one through
+    host_state.end_trial()
+    assert host_state.before_request()
+    # A failed trial opens the circuit again
+    host_state.on_failure()
+    with pytest.raises(CircuitOpenError):
+        host_state.before_request()
+
+    host_state.open_until = time.time() - 1
+    assert host_state.before_request()
+    host_state.on_success(0.1)
+    assert not host_state.before_request()
+    assert host_state.consecutive_failures == 0
+
+
+def test_retry_budget_refills_by_ratio_up_to_max():
+    retry_budget = util_request._RetryBudget()
+    for _ in range(util_request._RETRY_BUDGET_MAX_TOKENS):
+        assert retry_budget.try_withdraw()
+    assert not retry_budget.try_withdraw()
+
+    requests_per_retry = round(1 / util_request._RETRY_BUDGET_RATIO)
+    for _ in range(requests_per_retry - 1):
+        retry_budget.on_request()
+    assert not retry_budget.try_withdraw()
+    retry_budget.on_request()
+    assert retry_budget.try_withdraw()
+    assert not retry_budget.try_withdraw()
+
+    for _ in range(requests_per_retry * (util_request._RETRY_BUDGET_MAX_TOKENS + 10)):
+        retry_budget.on_request()
+    assert retry_budget.tokens == util_request._RETRY_BUDGET_MAX_TOKENS
+
+
+def test_nested_deadline_never_extends_the_outer_one():
+    assert util_request._get_remaining_secs() is None
+    with request_deadline(10):
+        with request_deadline(100):
+            assert util_request._get_remaining_secs() <= 10
+        with request_deadline(1):
+            assert util_request._get_remaining_secs() <= 1
+        with request_deadline(None):
+            assert 1 < util_request._get_remaining_secs() <= 10
+        assert 1 < util_request._get_remaining_secs() <= 10
+    assert util_request._get_remaining_secs() is None
+
+
+def test_deadline_clipped_timeout_does_not_count_toward_circuit(monkeypatch):
+    timeouts = []
+
+    def request_in_session(method, url, **kargs):  # pylint: disable=unused-argument
+        timeouts.append(kargs['timeout'])
+        raise requests.exceptions.ReadTimeout('Read timed out')
+
+    monkeypatch.setattr(util_request, '_request_in_session', request_in_session)
+    host_state = util_request._HostState(_HOST)
+    with request_deadline(1):
+        with pytest.raises(DeadlineExceededError):
+            util_request._send_request_once('GET', _URL, host_state, True, timeout=5)
+    assert timeouts[0] <= 1
+    assert host_state.consecutive_failures == 0
+
+    # Without a deadline, the same timeout is a failure of the host
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        util_request._send_request_once('GET', _URL, host_state, True, timeout=5)
+    assert host_state.consecutive_failures == 1
+
+
+def test_server_error_is_returned_without_counting_toward_circuit(monkeypatch):
+    monkeypatch.setattr(util_request, '_request_in_session',
+                        lambda method, url, **kargs: _make_response(503))
+    host_state = util_request._HostState(_HOST)
+    for _ in range(util_request._CIRCUIT_FAILURE_THRESHOLD + 1):
+        response = util_request._send_request_once('GET', _URL, host_state, True, timeout=5)
+        assert response.status_code == 503
+    assert host_state.consecutive_failures == 0
+    assert not host_state.latencies
+
+
+def test_hedged_request_is_sent_inline_when_pool_is_busy(monkeypatch):
+    release_event = threading.Event()
+    busy_executor = ThreadPoolExecutor(max_workers=1)
+    busy_executor.submit(release_event.wait)
+    monkeypatch.setattr(util_request, '_HEDGE_EXECUTOR', busy_executor)
+    monkeypatch.setattr(util_request, '_request_in_session',
+                        lambda method, url, **kargs: _make_response(200))
+    try:
+        start_time = time.time()
+        response = util_request._send_hedged_request('GET', _URL, 0.05, timeout=5)
+        assert response.status_code == 200
+        assert time.time() - start_time < 1
+    finally:
+        release_event.set()
+        busy_executor.shutdown()
@@ -0,0 +1,45 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+import pytest
+import tiktoken
+
+import util_token
+from util_token import count_tokens, truncate_to_tokens
+
+# One token per utf-8 byte, so that a chinese character takes 3 tokens and the tests need not
+# download the encodings of the real models
+_BYTE_ENCODING = tiktoken.Encoding(name='bytes',
+                                   pat_str=r'[\s\S]',
+                                   mergeable_ranks={bytes([rank]): rank for rank in range(256)},
+                                   special_tokens={})
+_MODEL = 'gpt-3.5-turbo'
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(util_token, '_get_encoding', lambda model: _BYTE_ENCODING)
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+
+def test_count_tokens():
+    assert count_tokens('abc', _MODEL) == 3
+    assert count_tokens('新闻', _MODEL) == 6
+    assert count_tokens('', _MODEL) == 0
+
+
+def test_truncate_within_budget():
+    assert truncate_to_tokens('第一句。', 12, _MODEL) == '第一句。'
+
+
+def test_truncate_at_the_last_sentence_end():
+    # 第一句。is 12 tokens, the budget ends in the middle of the second sentence
+    assert truncate_to_tokens('第一句。第二句！第三句', 30, _MODEL) == '第一句。第二句！'
+    assert truncate_to_tokens('第一句。第二句！第三句', 20, _MODEL) == '第一句。'
+
+
+def test_truncate_without_sentence_end():
+    # The budget ends in the middle of 闻, whose broken bytes are dropped
+    assert truncate_to_tokens('今日新闻', 10, _MODEL) == '今日新'
+    assert truncate_to_tokens('今日新闻', 0, _MODEL) == ''
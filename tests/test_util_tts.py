@@ -0,0 +1,51 @@
+# Copyright @2023. All rights reserved.
+# Authors: luozhuofeng@gmail.com (Zhuofeng Luo)
+from typing import List
+
+import pytest
+
+from util_tts import StreamingSentenceSplitter, split_sentences
+
+_TXT = '北京今天迎来强降雨。气象台发布“暴雨蓝色预警！”请市民注意出行安全？明天转晴'
+
+
+def _split_streaming(pieces: List[str]) -> List[str]:
+    splitter = StreamingSentenceSplitter()
+    sentences = []
+    for piece in pieces:
+        sentences.extend(splitter.feed(piece))
+    return sentences + splitter.flush()
+
+
+def test_split_sentences():
+    assert split_sentences(_TXT) == [
+        '北京今天迎来强降雨。', '气象台发布“暴雨蓝色预警！”', '请市民注意出行安全？', '明天转晴'
+    ]
+
+
+@pytest.mark.parametrize('piece_size', [1, 2, 3, 7, len(_TXT)])
+def test_streaming_splits_the_same_as_split_sentences(piece_size: int):
+    pieces = [_TXT[index:index + piece_size] for index in range(0, len(_TXT), piece_size)]
+    assert _split_streaming(pieces) == split_sentences(_TXT)
+
+
+def test_streaming_waits_for_the_closing_quote():
+    splitter = StreamingSentenceSplitter()
+    assert not splitter.feed('他说：“下雨了！')
+    # The closing quote has nothing to speak, so it still belongs to the previous sentence
+    assert not splitter.feed('”')
+    assert splitter.feed('大家') == ['他说：“下雨了！”']
+    assert splitter.flush() == ['大家']
+    assert not splitter.flush()
+
+
+def test_streaming_keeps_only_the_unfinished_sentence():
+    splitter = StreamingSentenceSplitter()
+    assert splitter.feed('北京今天迎来强降雨。气象台发布') == ['北京今天迎来强降雨。']
+    assert splitter.txt == '气象台发布'
+    assert splitter.feed('预警。请注意') == ['气象台发布预警。']
+    assert splitter.txt == '请注意'
+
+
+def test_streaming_empty_text():
+    assert not _split_streaming(['', ' ', '\n'])